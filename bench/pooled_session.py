@@ -0,0 +1,134 @@
+import argparse
+import concurrent.futures
+import importlib.util
+import json
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+import urllib3
+
+'''
+连接池基准测试
+----------------------------------------------------------
+在本机启动一个模拟Gitea contents接口的HTTPS服务器，模拟同时展开15个文件夹：
+分别用裸requests.get（每次请求新建连接）和GiteaClient（共用连接池）发送，
+比较每轮耗时和服务器收到的TLS握手（新连接）次数
+
+python bench/pooled_session.py [--latency 5] [--rounds 10] [--http]
+需要openssl命令生成临时自签名证书，没有openssl时使用--http只比较TCP连接
+'''
+
+SOURCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '源码', 'Code（依赖Git）', 'Gitea GUI.py')
+FOLDER_COUNT = 15  # 同时展开的文件夹数，与线程池大小一致
+
+connection_count = 0  # 服务器收到的新连接数
+connection_lock = threading.Lock()
+latency = 0.0  # 服务器处理每个请求的延迟（秒）
+
+
+# 模拟contents接口，返回一个文件夹的内容
+class ContentsHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # 支持keep-alive
+    disable_nagle_algorithm = True  # 与Gitea一致，避免响应头和响应体分开发送时被延迟确认卡住
+
+    # 每个新连接调用一次
+    def setup(self):
+        global connection_count
+        super().setup()
+        with connection_lock:
+            connection_count += 1
+
+    # 延迟后返回一个文件夹的内容
+    def do_GET(self):
+        time.sleep(latency)
+        body = json.dumps([{'name': f'file{i}.txt', 'path': f'src/file{i}.txt', 'type': 'file', 'size': 10}
+                           for i in range(20)]).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # 不输出访问日志
+    def log_message(self, format, *args):
+        pass
+
+
+# 用openssl生成临时自签名证书，返回服务器端SSLContext
+def create_ssl_context(directory):
+    cert_path = os.path.join(directory, 'cert.pem')
+    key_path = os.path.join(directory, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=127.0.0.1',
+                    '-keyout', key_path, '-out', cert_path], check=True, capture_output=True)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_path, key_path)
+    return context
+
+
+# 启动服务器，返回基础地址
+def start_server(use_https, directory):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ContentsHandler)
+    server.daemon_threads = True
+    scheme = 'http'
+    if use_https:
+        server.socket = create_ssl_context(directory).wrap_socket(server.socket, server_side=True)
+        scheme = 'https'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'{scheme}://127.0.0.1:{server.server_address[1]}'
+
+
+# 导入主程序中的GiteaClient
+def load_gitea_client():
+    spec = importlib.util.spec_from_file_location('gitea_gui', SOURCE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.GiteaClient
+
+
+# 多轮同时请求所有文件夹，返回(每轮平均耗时毫秒, 新连接数)
+def run(fetch, urls, rounds):
+    global connection_count
+    connection_count = 0
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(FOLDER_COUNT) as executor:
+        for _ in range(rounds):
+            list(executor.map(fetch, urls))
+    return (time.perf_counter() - start) / rounds * 1000, connection_count
+
+
+# 解析参数，依次运行两种方式并输出结果
+def main():
+    global latency
+    parser = argparse.ArgumentParser(description='比较裸requests.get和共用连接池的GiteaClient')
+    parser.add_argument('--latency', type=float, default=5, help='服务器处理每个请求的延迟（毫秒）')
+    parser.add_argument('--rounds', type=int, default=10, help='同时展开的轮数')
+    parser.add_argument('--http', action='store_true', help='不使用TLS')
+    args = parser.parse_args()
+    latency = args.latency / 1000
+    warnings.filterwarnings('ignore')
+    urllib3.disable_warnings()  # 自签名证书不做验证
+
+    with tempfile.TemporaryDirectory() as directory:
+        base_url = start_server(not args.http, directory)
+        urls = [f'{base_url}/api/v1/repos/alice/repo{i:04d}/contents/src' for i in range(FOLDER_COUNT)]
+        bare = run(lambda url: requests.get(url, auth=('alice', 'pw'), verify=False).json(), urls, args.rounds)
+        client = load_gitea_client()(base_url, 'alice', 'pw')
+        pooled = run(lambda url: client.get(url, verify=False).json(), urls, args.rounds)
+        client.close()
+
+    handshake = 'TCP连接' if args.http else 'TLS握手'
+    print(f'延迟 {args.latency:g} ms，每轮同时展开 {FOLDER_COUNT} 个文件夹，共 {args.rounds} 轮')
+    print(f'裸requests.get：每轮 {bare[0]:.1f} ms，{handshake} {bare[1]} 次')
+    print(f'GiteaClient：  每轮 {pooled[0]:.1f} ms，{handshake} {pooled[1]} 次')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
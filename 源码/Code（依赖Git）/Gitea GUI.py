@@ -1,16 +1,36 @@
+import asyncio
+import hashlib
 import json
+import math
 import os
+import re
+import shutil
+import sqlite3
 import subprocess
 import sys
+import tarfile
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit, quote
 
 import git
 import requests
 from PyQt6 import uic
-from PyQt6.QtCore import Qt, pyqtSignal, QRunnable, QObject, QThreadPool
-from PyQt6.QtGui import QIcon
-from PyQt6.QtWidgets import QApplication, QMessageBox, QTreeWidgetItem, QFileDialog, QTreeWidget, \
-    QPushButton, QCheckBox, QLineEdit, QTextEdit
+from PyQt6.QtCore import Qt, pyqtSignal, QRunnable, QObject, QThreadPool, QAbstractItemModel, QModelIndex, QTimer, \
+    QAbstractTableModel, QStringListModel
+from PyQt6.QtGui import QIcon, QFont
+from PyQt6.QtWidgets import QApplication, QMessageBox, QFileDialog, QTreeView, \
+    QPushButton, QCheckBox, QLineEdit, QPlainTextEdit, QMenu, QTableView, QLabel, \
+    QCompleter
 from git import remote
+from requests.adapters import HTTPAdapter
+
+try:
+    import aiohttp  # 可选依赖，只有asyncio网络引擎需要
+except ImportError:
+    aiohttp = None
 
 '''
 Gitea API接口
@@ -21,15 +41,364 @@ service_url = 'http://localhost:3000'  # 默认地址
 login_url = f'{service_url}/api/v1/user'
 获取用户的所有仓库
 get_repo_url = f'{service_url}/api/v1/user/repos'
+搜索用户有权访问的仓库
+search_repo_url = f'{service_url}/api/v1/repos/search'
 获取指定文件的详细信息
 get_contents_url = f'{service_url}/api/v1/repos/{repo_owner}/{repo_name}/contents/{file_path}'
+下载文件内容（LFS文件返回实际内容）
+get_media_url = f'{service_url}/api/v1/repos/{repo_owner}/{repo_name}/media/{ref}/{file_path}'
+下载仓库压缩包
+get_archive_url = f'{service_url}/api/v1/repos/{repo_owner}/{repo_name}/archive/{ref}.tar.gz'
 ----------------------------------------------------------
 '''
 service_url = None
 login_url = None
 get_repo_url = None
+search_repo_url = None
 Username = None
 Password = None
+gitea_client = None  # 登录成功后创建的Gitea API客户端
+async_engine = None  # 启用asyncio网络引擎时，浏览用的请求都通过它发送
+object_cache_locks = {}  # 共享对象缓存中每个裸仓库的锁
+object_cache_locks_lock = threading.Lock()
+
+MAX_THREAD_COUNT = 15  # 线程池最多线程数，同时也是连接池的大小
+ASYNC_CONCURRENCY = 100  # asyncio网络引擎默认同时进行的最多请求数
+DOWNLOAD_CONCURRENCY = 4  # 默认同时下载的仓库数
+DOWNLOAD_MODE = 'partial'  # full：拉取完整历史；partial：只拉取最新提交，文件内容按需获取
+REPO_PAGE_LIMIT = 50  # 获取仓库列表时每页的数量（Gitea默认最多50）
+REPO_PAGE_WORKERS = 8  # 并发获取仓库列表分页的最大请求数
+CACHE_PATH = './data/cache.db'  # 仓库列表和目录内容的磁盘缓存
+CACHE_USED_FLUSH = 500  # 读取缓存时最近使用时间先记在内存中，积累多少条后写入数据库
+GIT_TREE_PAGE_SIZE = 1000  # git/trees接口每页的条目数（Gitea默认最多1000）
+FETCH_BATCH_SIZE = 256  # 目录树视图每次显示的子节点数量，滚动到底部时再显示下一批
+MERGE_CHUNK_SIZE = 2000  # 合并目录内容时每次处理的条目数，两块之间让出事件循环
+DOWNLOAD_CHUNK_SIZE = 64 * 1024  # 直接下载文件时每次写入的字节数
+SYNC_STATE_PATH = './data/sync_state.json'  # 各本地仓库上次同步到的提交和已下载的路径
+DOWNLOAD_JOURNAL_PATH = './data/download_journal.json'  # 正在进行的下载任务，中断后下次启动时继续
+PROGRESS_INTERVAL = 0.2  # 每个下载任务两次进度更新之间的最短间隔（秒）
+SEARCH_DELAY = 200  # 搜索框停止输入多久后开始搜索（毫秒）
+LOG_MAX_LINES = 1000  # 日志最多保留的行数，超出后删除最早的行
+PROGRESS_REFRESH_INTERVAL = 1000  # 下载进度表刷新间隔（毫秒）
+RATE_WINDOW = 1.0  # 计算下载速度的最短采样间隔（秒）
+STALL_TIMEOUT = 30  # 下载任务超过多少秒没有任何进度时标记为停滞
+OBJECT_CACHE_PATH = './data/objects'  # 共享的git对象缓存，每个远程仓库一个裸仓库
+PATH_INDEX_PATH = './data/path_index.db'  # 跨仓库的文件路径索引
+PATH_SEARCH_LIMIT = 200  # 文件路径搜索最多显示的结果数
+PATH_SEARCH_MIN_LENGTH = 3  # 路径搜索的最短文本，更短的文本无法使用trigram索引，需要扫描所有路径
+PREFETCH_DEPTH = 1  # 展开文件夹后预取几层子文件夹，为0时不预取
+PREFETCH_BREADTH = 20  # 每个文件夹最多预取的子文件夹数
+PREFETCH_CONCURRENCY = 2  # 同时进行的预取请求数
+PREFETCH_QUEUE_LIMIT = 50  # 等待预取的文件夹数上限，超出时丢弃最早加入的
+PREFETCH_PRIORITY = -1  # 预取任务在线程池中的优先级，排在用户操作的请求之后
+HOVER_DELAY = 300  # 鼠标在文件夹上停留多久后预取（毫秒）
+
+
+# 读取配置项，配置文件中没有此项时使用默认值
+def get_config_value(key, default):
+    with open('./data/config.json', 'r') as f:
+        data = json.load(f)
+    return data.get(key, default)
+
+
+# 带缓存的请求结果
+class ApiResponse:
+    def __init__(self, response, data=None, headers=None, modified=True):
+        self.response = response
+        self.status_code = response.status_code
+        self.data = data
+        self.headers = headers if headers is not None else {}
+        self.modified = modified  # 为False表示服务器返回304，内容与缓存一致
+        self.ok = data is not None  # 请求成功（200或304）
+
+
+# 磁盘缓存
+# 以URL为键保存API返回的JSON及其ETag/Last-Modified，用于发送条件请求，
+# 内容未变化时服务器只返回304；总大小超过上限时淘汰最久未使用的条目
+class ResponseCache:
+    saved_headers = ('X-Total-Count',)  # 需要随内容一起缓存的响应头
+
+    def __init__(self, path, max_size):
+        self.max_size = max_size
+        self.hits = 0  # 本次运行中验证后仍然有效的次数
+        self.misses = 0  # 本次运行中没有缓存或缓存已失效的次数
+        self.lock = threading.Lock()
+        self.used = {}  # 尚未写入数据库的最近使用时间，键 -> 时间
+        self.closed = False  # 退出程序时关闭，之后仍在运行的线程不再读写
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS responses ('
+                        'key TEXT PRIMARY KEY, url TEXT, etag TEXT, last_modified TEXT, '
+                        'headers TEXT, body TEXT, size INTEGER, last_used REAL)')
+        self.db.commit()
+        self.total_size = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    # 缓存键，不同用户访问同一URL（如/user/repos）的结果不同，因此加入用户名
+    @staticmethod
+    def make_key(username, url, params=None):
+        text = f'{username}\n{url}\n{sorted((params or {}).items())}'
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    # 读取缓存条目
+    # 最近使用时间只记在内存中，写入缓存或积累CACHE_USED_FLUSH条时才批量写入，读取时不提交事务
+    def get(self, key):
+        with self.lock:
+            if self.closed:
+                return None
+            row = self.db.execute('SELECT etag, last_modified, headers, body FROM responses WHERE key = ?',
+                                  (key,)).fetchone()
+            if row is None:
+                return None
+            self.used[key] = time.time()
+            if len(self.used) >= CACHE_USED_FLUSH:
+                self.flush_used()
+                self.db.commit()
+        etag, last_modified, headers, body = row
+        return {'etag': etag, 'last_modified': last_modified, 'headers': json.loads(headers),
+                'data': json.loads(body)}
+
+    # 写入缓存条目
+    def put(self, key, url, response):
+        headers = {name: response.headers[name] for name in self.saved_headers if name in response.headers}
+        body = response.text
+        size = len(body.encode('utf-8'))
+        with self.lock:
+            if self.closed:
+                return
+            old = self.db.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            if old is not None:
+                self.total_size -= old[0]
+            self.db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                            (key, url, response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                             json.dumps(headers), body, size, time.time()))
+            self.total_size += size
+            self.flush_used()  # 淘汰前先写入最近使用时间
+            self.evict()
+            self.db.commit()
+
+    # 将内存中的最近使用时间写入数据库（调用时需持有锁）
+    def flush_used(self):
+        if self.used:
+            self.db.executemany('UPDATE responses SET last_used = ? WHERE key = ?',
+                                [(used_time, key) for key, used_time in self.used.items()])
+            self.used.clear()
+
+    # 淘汰最久未使用的条目，直到总大小不超过上限（调用时需持有锁）
+    def evict(self):
+        while self.total_size > self.max_size:
+            row = self.db.execute('SELECT key, size FROM responses ORDER BY last_used LIMIT 1').fetchone()
+            if row is None:
+                break
+            self.db.execute('DELETE FROM responses WHERE key = ?', (row[0],))
+            self.total_size -= row[1]
+
+    # 记录一次缓存是否命中
+    def record(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    # 命中率
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    # 关闭数据库
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.flush_used()
+            self.db.commit()
+            self.db.close()
+
+
+# 任务已被取消
+class JobCancelled(Exception):
+    pass
+
+
+# 取消标记，每个网络任务一个
+# 界面取消任务后，任务在下一次请求前、或收到响应头还没有读取响应体时停止；
+# generation为创建时界面的代数，目录树重建后旧代数的任务结果一律丢弃
+class CancelToken:
+    def __init__(self, generation):
+        self.generation = generation
+        self.event = threading.Event()
+        self.future = None  # 在asyncio网络引擎中运行时的Future，取消时立即中断正在等待的请求
+
+    def cancel(self):
+        self.event.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    # 已取消时抛出JobCancelled
+    def check(self):
+        if self.event.is_set():
+            raise JobCancelled()
+
+
+# Gitea API客户端
+# 所有请求共用同一个Session，复用TCP/TLS连接（keep-alive），避免每次请求都重新握手
+class GiteaClient:
+    def __init__(self, url, username, password, pool_size=MAX_THREAD_COUNT, cache=None):
+        self.service_url = url
+        self.username = username
+        self.cache = cache  # ResponseCache，为None时不使用缓存
+        self.session = requests.Session()
+        self.session.auth = (username, password)  # 预设基本认证
+        self.session.headers.update({
+            'Accept': 'application/json',
+            'Accept-Encoding': 'gzip',
+            'Connection': 'keep-alive',
+        })
+        # 连接池大小与线程池一致，每个线程都能拿到一个空闲连接
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    # GET请求
+    # 传入token时先只接收响应头，任务已被取消就关闭连接，不再读取响应体
+    def get(self, url, token=None, **kwargs):
+        if token is None:
+            return self.session.get(url, **kwargs)
+        token.check()
+        response = self.session.get(url, stream=True, **kwargs)
+        if token.cancelled:
+            response.close()
+            raise JobCancelled()
+        response.content  # 读取完整的响应体
+        return response
+
+    # 只读取缓存的内容而不发送请求，用于在重新验证之前先绘制界面
+    def get_cached(self, url, params=None):
+        if self.cache is None:
+            return None
+        return self.cache.get(ResponseCache.make_key(self.username, url, params))
+
+    # 带缓存验证的GET请求，有缓存时携带If-None-Match/If-Modified-Since，服务器返回304时直接使用缓存
+    def get_json(self, url, params=None, token=None):
+        return self.revalidate(url, self.get_cached(url, params), params, token)
+
+    # 用已经读取的缓存条目（没有缓存时为None）发送条件请求，调用者已读过缓存时不必再读一次
+    def revalidate(self, url, entry, params=None, token=None):
+        response = self.get(url, token, params=params, headers=self.conditional_headers(entry))
+        return self.make_result(url, params, entry, response)
+
+    # 缓存条目对应的条件请求头
+    @staticmethod
+    def conditional_headers(entry):
+        headers = {}
+        if entry is not None:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    # 根据响应生成结果：304时使用缓存的内容，200时更新缓存
+    def make_result(self, url, params, entry, response):
+        if self.cache is None:
+            data = response.json() if response.status_code == 200 else None
+            return ApiResponse(response, data, response.headers)
+        if response.status_code == 304 and entry is not None:
+            self.cache.record(True)
+            return ApiResponse(response, entry['data'], entry['headers'], modified=False)
+        if response.status_code == 200:
+            self.cache.record(False)
+            self.cache.put(ResponseCache.make_key(self.username, url, params), url, response)
+            return ApiResponse(response, response.json(), response.headers)
+        return ApiResponse(response)
+
+    # 关闭连接池
+    def close(self):
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+
+# aiohttp响应的内容，提供与requests.Response相同的status_code、headers、text和json()，可以直接交给缓存和ApiResponse
+class AsyncResponse:
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers  # 不区分大小写
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+# asyncio网络引擎
+# 在一个后台线程中运行asyncio事件循环，用aiohttp发送请求：等待响应的请求不占用线程，
+# 同时进行的请求数只受信号量（async_concurrency）限制；缓存与GiteaClient共用
+# 预取等后台请求使用另外的小信号量（PREFETCH_CONCURRENCY），不占用用户操作的名额
+class AsyncEngine:
+    def __init__(self, client, password, concurrency=ASYNC_CONCURRENCY):
+        self.client = client
+        self.password = password
+        self.concurrency = concurrency
+        self.session = None
+        self.semaphore = None
+        self.background_semaphore = None
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name='AsyncEngine', daemon=True).start()
+        self.submit(self.open()).result()
+
+    # aiohttp的会话和信号量必须在事件循环中创建
+    async def open(self):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.background_semaphore = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+        self.session = aiohttp.ClientSession(auth=aiohttp.BasicAuth(self.client.username, self.password),
+                                             headers={'Accept': 'application/json'},
+                                             connector=aiohttp.TCPConnector(limit=self.concurrency + PREFETCH_CONCURRENCY))
+
+    # 在事件循环中运行协程，可以从任意线程调用，返回concurrent.futures.Future
+    def submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    # GET请求，与GiteaClient.get相同，收到响应头后任务已取消就不再读取响应体
+    # background为True时使用后台请求的信号量
+    async def get(self, url, token=None, params=None, headers=None, background=False):
+        async with self.background_semaphore if background else self.semaphore:
+            if token is not None:
+                token.check()
+            async with self.session.get(url, params=params, headers=headers) as response:
+                if token is not None:
+                    token.check()
+                return AsyncResponse(response.status, response.headers.copy(), await response.read())
+
+    # 带缓存验证的GET请求，与GiteaClient.get_json相同
+    async def get_json(self, url, params=None, token=None, background=False):
+        return await self.revalidate(url, self.client.get_cached(url, params), params, token, background)
+
+    # 用已经读取的缓存条目发送条件请求，与GiteaClient.revalidate相同
+    async def revalidate(self, url, entry, params=None, token=None, background=False):
+        response = await self.get(url, token, params=params, headers=self.client.conditional_headers(entry),
+                                  background=background)
+        return self.client.make_result(url, params, entry, response)
+
+    # 关闭会话并停止事件循环
+    def close(self):
+        self.submit(self.session.close()).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+# 退出程序前关闭网络引擎和客户端，将缓存中尚未写入的最近使用时间保存到数据库
+def close_clients():
+    if async_engine is not None:
+        async_engine.close()
+    if gitea_client is not None:
+        gitea_client.close()
 
 
 # 登录UI
@@ -151,7 +520,7 @@ class LoginUI:
 
     # 登录验证逻辑
     def login(self):
-        global service_url, login_url, get_repo_url, Username, Password
+        global service_url, login_url, get_repo_url, search_repo_url, Username, Password, gitea_client, async_engine
 
         service_url = self.url.text()  # 修改服务器地址
         Username = self.username_edit.text()
@@ -162,10 +531,19 @@ class LoginUI:
         login_url = f'{service_url}/api/v1/user'
         # 获取用户的所有仓库
         get_repo_url = f'{service_url}/api/v1/user/repos'
+        # 搜索仓库
+        search_repo_url = f'{service_url}/api/v1/repos/search'
 
+        cache = ResponseCache(CACHE_PATH, get_config_value('cache_max_size_mb', 50) * 1024 * 1024)
+        client = GiteaClient(service_url, Username, Password, cache=cache)
         try:
-            response = requests.get(login_url, auth=(Username, Password))
+            response = client.get(login_url)
             if response.status_code == 200:
+                gitea_client = client  # 登录成功，后续请求均通过此客户端
+                # 启用asyncio网络引擎，没有安装aiohttp时仍使用线程池
+                if get_config_value('network_engine', 'threads') == 'asyncio' and aiohttp is not None:
+                    async_engine = AsyncEngine(client, Password, get_config_value('async_concurrency', ASYNC_CONCURRENCY))
+
                 # 保存信息
                 self.save_url(service_url)
                 self.save_username(Username)
@@ -177,46 +555,236 @@ class LoginUI:
                 self.mainUI = MainUI()  # 打开主窗口
 
             else:
+                client.close()
                 QMessageBox.critical(self.login_ui, "登录失败", "用户名或密码错误",
                                      QMessageBox.StandardButton.Retry)
         except requests.exceptions.RequestException as e:
+            client.close()
             QMessageBox.critical(self.login_ui, "错误", str(e), QMessageBox.StandardButton.Ok)
 
 
+# 请求失败时的错误信息
+# 代理等返回的错误页不是Gitea的JSON错误信息时，显示响应内容的开头
+def http_error_message(response, url):
+    try:
+        error = response.json()
+        return f'HTTP {str(response.status_code)}\n{url}\n\nerrors:{error["errors"]}\nmessage:{error["message"]}'
+    except (ValueError, KeyError, TypeError):
+        return f'HTTP {str(response.status_code)}\n{url}\n\n{response.text[:500]}'
+
+
 # 获取用户仓库线程
 class GetReposSignal(QObject):
     get_ready = pyqtSignal(tuple)
+    reset_signal = pyqtSignal(object)  # 缓存的仓库列表已过期，需要清空后重新添加
     error_signal = pyqtSignal(str)
+    finish_signal = pyqtSignal()
 
 
 class GetRepos(QRunnable):
-    def __init__(self, url, ui, tree_widget_item):
+    def __init__(self, url, ui, node, token):
         super().__init__()
         self.url = url
         self.ui = ui
-        self.tree_widget_item = tree_widget_item
+        self.node = node
+        self.token = token
         self.signals = GetReposSignal()
+        self.painted_pages = []  # 已经用缓存绘制的页
+        self.fresh_pages = []  # 从服务器验证过的页
+        self.repainted = False  # 缓存过期后是否已经重新绘制
+        self.page_size = REPO_PAGE_LIMIT  # 每页的实际数量，服务器的MAX_RESPONSE_ITEMS可能小于请求的limit
+        self.total_cached = False  # 总数来自缓存（第一页返回304），可能已经过时
 
     def run(self):
         try:
-            # 此api每页最多返回50个结果，因此需要循环获取
-            page_num = 1
-            while True:
-                params = {'page': page_num, 'limit': 50}
-                response = requests.get(self.url, auth=(Username, Password), params=params)
-                if response.status_code == 200:
-                    if len(response.json()) != 0:
-                        data = response.json()
-                        # 将结果传递出去
-                        data_tuple = (data, self.tree_widget_item)
-                        self.signals.get_ready.emit(data_tuple)
-                        page_num += 1
-                    else:  # 页面为空，结果获取结束
-                        break
+            # 先用缓存的仓库列表绘制界面
+            self.paint_cached_pages()
+
+            # 获取第一页，从X-Total-Count响应头得知仓库总数
+            result = self.get_page(1)
+            if not result.ok:
+                self.signals.error_signal.emit(http_error_message(result.response, self.url))
+                return
+            if len(result.data) != 0:
+                self.deliver(result.data)
+
+                total_count = result.headers.get('X-Total-Count')
+                self.page_size = len(result.data)  # 以第一页的实际数量为准
+                self.total_cached = not result.modified
+                if total_count is None:  # 服务器没有返回总数，只能逐页获取
+                    self.get_pages_serial()
                 else:
-                    self.signals.error_signal.emit(
-                        f'HTTP {str(response.status_code)}\n{self.url}\n\nerrors:{response.json()["errors"]}\nmessage:{response.json()["message"]}')
-        except requests.exceptions as e:
+                    page_count = math.ceil(int(total_count) / self.page_size)
+                    self.get_pages_parallel(page_count)
+
+            # 服务器上的仓库比缓存中少
+            if not self.repainted and len(self.fresh_pages) < len(self.painted_pages):
+                self.repaint()
+        except JobCancelled:  # 已被新的刷新取代
+            pass
+        except requests.exceptions.RequestException as e:
+            self.signals.error_signal.emit(str(e) + '\n' + self.url)
+        finally:
+            self.signals.finish_signal.emit()
+
+    # 与run相同，在asyncio网络引擎中运行，剩余页同时请求，并发数由引擎限制
+    async def run_async(self):
+        try:
+            self.paint_cached_pages()
+
+            result = await async_engine.get_json(self.url, self.page_params(1), self.token)
+            if not result.ok:
+                self.signals.error_signal.emit(http_error_message(result.response, self.url))
+                return
+            if len(result.data) != 0:
+                self.deliver(result.data)
+
+                total_count = result.headers.get('X-Total-Count')
+                self.page_size = len(result.data)
+                self.total_cached = not result.modified
+                page_num = 2
+                if total_count is not None:
+                    page_count = math.ceil(int(total_count) / self.page_size)
+                    tasks = [asyncio.ensure_future(async_engine.get_json(self.url, self.page_params(page_num), self.token))
+                             for page_num in range(2, page_count + 1)]
+                    try:
+                        for task in tasks:  # 按页码顺序传递结果
+                            result = await task
+                            if not result.ok:
+                                self.signals.error_signal.emit(http_error_message(result.response, self.url))
+                                return
+                            if len(result.data) != 0:
+                                self.deliver(result.data)
+                    finally:
+                        for task in tasks:
+                            task.cancel()
+                    page_num = page_count + 1
+
+                # 没有总数，或总数来自缓存时最后一页是满的，逐页向后获取
+                while total_count is None or (self.total_cached and len(self.fresh_pages[-1]) == self.page_size):
+                    result = await async_engine.get_json(self.url, self.page_params(page_num), self.token)
+                    if not result.ok:
+                        self.signals.error_signal.emit(http_error_message(result.response, self.url))
+                        return
+                    if len(result.data) == 0:
+                        break
+                    self.deliver(result.data)
+                    page_num += 1
+
+            if not self.repainted and len(self.fresh_pages) < len(self.painted_pages):
+                self.repaint()
+        except JobCancelled:
+            pass
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:  # ValueError：响应内容不是JSON
+            self.signals.error_signal.emit(str(e) + '\n' + self.url)
+        finally:
+            self.signals.finish_signal.emit()
+
+    # 分页参数
+    @staticmethod
+    def page_params(page_num):
+        return {'page': page_num, 'limit': REPO_PAGE_LIMIT}
+
+    # 获取指定页的仓库
+    def get_page(self, page_num):
+        return gitea_client.get_json(self.url, params=self.page_params(page_num), token=self.token)
+
+    # 用缓存中连续的页绘制仓库列表
+    def paint_cached_pages(self):
+        page_num = 1
+        while True:
+            entry = gitea_client.get_cached(self.url, self.page_params(page_num))
+            if entry is None or len(entry['data']) == 0:
+                break
+            self.painted_pages.append(entry['data'])
+            self.signals.get_ready.emit((entry['data'], self.node))
+            page_num += 1
+
+    # 按页码顺序传递结果，与缓存一致的页不再重复绘制
+    def deliver(self, data):
+        index = len(self.fresh_pages)
+        self.fresh_pages.append(data)
+        if self.repainted or index >= len(self.painted_pages):
+            self.signals.get_ready.emit((data, self.node))
+        elif data != self.painted_pages[index]:  # 缓存已过期
+            self.repaint()
+
+    # 清空缓存绘制的内容，用已验证的页重新绘制
+    def repaint(self):
+        self.repainted = True
+        self.signals.reset_signal.emit(self.node)
+        for data in self.fresh_pages:
+            self.signals.get_ready.emit((data, self.node))
+
+    # 逐页获取，直到返回空页面
+    def get_pages_serial(self, page_num=2):
+        while True:
+            result = self.get_page(page_num)
+            if not result.ok:
+                self.signals.error_signal.emit(http_error_message(result.response, self.url))
+                return
+            if len(result.data) == 0:  # 页面为空，结果获取结束
+                return
+            self.deliver(result.data)
+            page_num += 1
+
+    # 并发获取剩余页，但仍按页码顺序将结果传递出去
+    def get_pages_parallel(self, page_count):
+        with ThreadPoolExecutor(max_workers=REPO_PAGE_WORKERS) as executor:
+            futures = [executor.submit(self.get_page, page_num) for page_num in range(2, page_count + 1)]
+            for future in futures:
+                result = future.result()
+                if not result.ok:
+                    self.signals.error_signal.emit(http_error_message(result.response, self.url))
+                    for rest in futures:  # 出错后不再等待尚未开始的请求
+                        rest.cancel()
+                    return
+                if len(result.data) != 0:
+                    self.deliver(result.data)
+
+        # 总数来自缓存时可能已经过时，最后一页是满的就继续向后获取
+        if self.total_cached and len(self.fresh_pages[-1]) == self.page_size:
+            self.get_pages_serial(page_count + 1)
+
+
+# 服务器搜索仓库线程
+class SearchReposSignal(QObject):
+    get_ready = pyqtSignal(tuple)  # (一页搜索结果, 搜索文本)
+    error_signal = pyqtSignal(str)
+
+
+# 逐页获取搜索结果，每页获取后立即显示；搜索文本变化后取消，不再获取后面的页
+class SearchRepos(QRunnable):
+    def __init__(self, url, text, token):
+        super().__init__()
+        self.url = url
+        self.text = text
+        self.token = token
+        self.signals = SearchReposSignal()
+
+    def run(self):
+        page_num = 1
+        received = 0
+        try:
+            while True:
+                # 搜索结果随时变化，不使用缓存
+                params = {'q': self.text, 'page': page_num, 'limit': REPO_PAGE_LIMIT}
+                response = gitea_client.get(self.url, self.token, params=params)
+                if response.status_code != 200:
+                    self.signals.error_signal.emit(http_error_message(response, self.url))
+                    return
+                data = response.json()['data']
+                if len(data) == 0:
+                    return
+                self.signals.get_ready.emit((data, self.text))
+                received += len(data)
+                total_count = response.headers.get('X-Total-Count')
+                if total_count is not None and received >= int(total_count):
+                    return
+                page_num += 1
+        except JobCancelled:
+            pass
+        except requests.exceptions.RequestException as e:
             self.signals.error_signal.emit(str(e) + '\n' + self.url)
 
 
@@ -224,115 +792,772 @@ class GetRepos(QRunnable):
 class GetDataSignal(QObject):
     get_ready = pyqtSignal(tuple)
     error_signal = pyqtSignal(str)
+    finish_signal = pyqtSignal()
 
 
 class GetData(QRunnable):
-    def __init__(self, url, ui, tree_widget_item):
+    def __init__(self, url, ui, node, token, revalidate=True):
         super().__init__()
         self.url = url
         self.ui = ui
-        self.tree_widget_item = tree_widget_item
+        self.node = node
+        self.token = token
+        self.revalidate = revalidate  # 为False时缓存中有内容就直接使用，不再向服务器验证
         self.signals = GetDataSignal()
 
     def run(self):
         try:
-            response = requests.get(self.url, auth=(Username, Password))
-            if response.status_code == 200:
-                data = response.json()
-                # 将结果传递出去
-                data_tuple = (data, self.tree_widget_item)
-                self.signals.get_ready.emit(data_tuple)
+            # 先用缓存绘制，再向服务器验证
+            entry = gitea_client.get_cached(self.url)
+            if entry is not None:
+                self.signals.get_ready.emit((entry['data'], self.node))
+                if not self.revalidate:  # 刚刚预取过，缓存就是最新的内容
+                    return
+
+            result = gitea_client.revalidate(self.url, entry, token=self.token)
+            if result.ok:
+                # 内容有变化时才重新绘制，304时内容一定与缓存一致，不必再逐项比较
+                if entry is None or (result.modified and result.data != entry['data']):
+                    # 将结果传递出去
+                    data_tuple = (result.data, self.node)
+                    self.signals.get_ready.emit(data_tuple)
             else:
-                self.signals.error_signal.emit(
-                    f'HTTP {str(response.status_code)}\n{self.url}\n\nerrors:{response.json()["errors"]}\nmessage:{response.json()["message"]}')
-        except requests.exceptions as e:
+                self.signals.error_signal.emit(http_error_message(result.response, self.url))
+        except JobCancelled:  # 文件夹已被刷新或目录树已重建
+            pass
+        except requests.exceptions.RequestException as e:
+            self.signals.error_signal.emit(str(e) + '\n' + self.url)
+        finally:
+            self.signals.finish_signal.emit()
+
+    # 与run相同，在asyncio网络引擎中运行
+    async def run_async(self):
+        try:
+            entry = gitea_client.get_cached(self.url)
+            if entry is not None:
+                self.signals.get_ready.emit((entry['data'], self.node))
+                if not self.revalidate:
+                    return
+
+            result = await async_engine.revalidate(self.url, entry, token=self.token)
+            if result.ok:
+                if entry is None or (result.modified and result.data != entry['data']):
+                    self.signals.get_ready.emit((result.data, self.node))
+            else:
+                self.signals.error_signal.emit(http_error_message(result.response, self.url))
+        except JobCancelled:
+            pass
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:  # ValueError：响应内容不是JSON
             self.signals.error_signal.emit(str(e) + '\n' + self.url)
+        finally:
+            self.signals.finish_signal.emit()
+
+
+# 预取文件夹内容线程
+class PrefetchSignal(QObject):
+    finish_signal = pyqtSignal(object)  # 文件夹内容，失败时为None
+
+
+# 预取文件夹内容，只写入缓存，不修改目录树；预取只是猜测，失败时不提示
+class Prefetch(QRunnable):
+    def __init__(self, url, token):
+        super().__init__()
+        self.url = url
+        self.token = token
+        self.signals = PrefetchSignal()
+
+    def run(self):
+        data = None
+        try:
+            data = gitea_client.get_json(self.url, token=self.token).data
+        except (JobCancelled, requests.exceptions.RequestException):
+            pass
+        finally:
+            self.signals.finish_signal.emit(data)
+
+    # 与run相同，在asyncio网络引擎中运行
+    async def run_async(self):
+        data = None
+        try:
+            data = (await async_engine.get_json(self.url, token=self.token, background=True)).data  # 不占用用户操作的名额
+        except (JobCancelled, aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            pass
+        finally:
+            self.signals.finish_signal.emit(data)
+
+
+# 请求失败
+class GiteaApiError(Exception):
+    pass
+
+
+# 获取分支最新提交的SHA，带ETag重新验证，分支没有变化时服务器只返回304
+def get_branch_sha(repo_owner, repo_name, branch, token=None):
+    url = f'{service_url}/api/v1/repos/{repo_owner}/{repo_name}/branches/{branch}'
+    result = gitea_client.get_json(url, token=token)
+    if not result.ok:
+        raise GiteaApiError(http_error_message(result.response, url))
+    return result.data['commit']['id']
+
+
+# 通过git/trees接口递归获取整个仓库的目录树
+# 条目超过一页时truncated为True，根据total_count并发获取剩余页
+# cached为False时不读写磁盘缓存，用于批量建立索引，避免大量目录树挤掉浏览时的缓存
+def get_git_tree(repo_owner, repo_name, sha, cached=True, token=None):
+    url = f'{service_url}/api/v1/repos/{repo_owner}/{repo_name}/git/trees/{sha}'
+    data = get_git_tree_page(url, 1, cached, token)
+    entries = list(data['tree'] or [])
+    if not data.get('truncated'):
+        return entries
+
+    page_size = len(entries)  # 服务器可能限制每页数量，以第一页的实际数量为准
+    total_count = data.get('total_count')
+    if total_count:
+        page_count = math.ceil(total_count / page_size)
+        with ThreadPoolExecutor(max_workers=REPO_PAGE_WORKERS) as executor:
+            for data in executor.map(lambda page_num: get_git_tree_page(url, page_num, cached, token), range(2, page_count + 1)):
+                entries.extend(data['tree'] or [])
+    else:  # 没有总数时逐页获取
+        page_num = 2
+        while data.get('truncated'):
+            data = get_git_tree_page(url, page_num, cached, token)
+            entries.extend(data['tree'] or [])
+            page_num += 1
+    return entries
+
+
+# 获取目录树的一页
+# 树按提交SHA获取，内容不会再变化，因此有缓存时直接使用而不再向服务器验证
+def get_git_tree_page(url, page_num, cached=True, token=None):
+    params = {'recursive': 'true', 'page': page_num, 'per_page': GIT_TREE_PAGE_SIZE}
+    if not cached:
+        response = gitea_client.get(url, token, params=params)
+        if response.status_code != 200:
+            raise GiteaApiError(http_error_message(response, url))
+        return response.json()
+    entry = gitea_client.get_cached(url, params)
+    if entry is not None:
+        return entry['data']
+    result = gitea_client.revalidate(url, None, params, token)
+    if not result.ok:
+        raise GiteaApiError(http_error_message(result.response, url))
+    return result.data
+
+
+# 仓库目录树索引
+# 按目录保存子条目，展开文件夹时直接从这里读取，不再请求服务器
+class RepoTreeIndex:
+    def __init__(self, sha, entries):
+        self.sha = sha
+        self.children = {'': []}  # 目录路径 -> [(名称, 类型, 大小)]，元组比字典占用内存少得多
+        for entry in entries:
+            path = entry['path']
+            parent, _, name = path.rpartition('/')
+            if entry['type'] == 'tree':
+                self.children.setdefault(path, [])
+                self.children.setdefault(parent, []).append((name, 'dir', 0))
+            elif entry['type'] == 'blob':
+                self.children.setdefault(parent, []).append((name, 'file', entry.get('size', 0)))
+
+    # 获取目录下的文件和文件夹，格式与contents接口相同
+    def list_dir(self, path):
+        return [{'name': name, 'type': kind, 'size': size} for name, kind, size in self.children.get(path, [])]
+
+
+# 获取仓库目录树线程
+class GetTreeSignal(QObject):
+    get_ready = pyqtSignal(tuple)
+    error_signal = pyqtSignal(str)
+    finish_signal = pyqtSignal()
+
+
+class GetTree(QRunnable):
+    def __init__(self, repo_owner, repo_name, branch, node, token):
+        super().__init__()
+        self.repo_owner = repo_owner
+        self.repo_name = repo_name
+        self.branch = branch
+        self.node = node
+        self.token = token
+        self.signals = GetTreeSignal()
+
+    def run(self):
+        try:
+            sha = get_branch_sha(self.repo_owner, self.repo_name, self.branch, self.token)
+            entries = get_git_tree(self.repo_owner, self.repo_name, sha, token=self.token)
+            self.signals.get_ready.emit((RepoTreeIndex(sha, entries), self.node))
+        except JobCancelled:
+            pass
+        except GiteaApiError as e:
+            self.signals.error_signal.emit(str(e))
+        except requests.exceptions.RequestException as e:
+            self.signals.error_signal.emit(f'{e}\n{self.repo_owner}/{self.repo_name}')
+        finally:
+            self.signals.finish_signal.emit()
+
+
+# 跨仓库的文件路径索引
+# 保存各仓库默认分支最新提交中的所有路径和建立索引时的提交SHA，SHA没有变化的仓库不再重新获取；
+# SQLite支持时用FTS5的trigram分词建立全文索引，三个字符以上的子串查询不必逐行扫描
+class PathIndex:
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS repos ('
+                        'id INTEGER PRIMARY KEY, owner TEXT, name TEXT, sha TEXT, UNIQUE (owner, name))')
+        self.db.execute('CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, repo_id INTEGER, path TEXT, kind TEXT)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS files_repo ON files (repo_id)')
+        try:
+            # 外部内容表：全文索引只保存trigram，路径本身仍在files表中
+            self.db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS file_paths USING fts5("
+                            "path, content='files', content_rowid='id', tokenize='trigram')")
+            self.fts = True
+        except sqlite3.OperationalError:  # SQLite版本过低，没有FTS5或trigram分词，查询时逐行匹配
+            self.fts = False
+        self.db.commit()
+
+    # 各仓库建立索引时的提交SHA
+    def repo_shas(self):
+        with self.lock:
+            return {(owner, name): sha for owner, name, sha in self.db.execute('SELECT owner, name, sha FROM repos')}
+
+    # 用仓库新提交的目录树替换原有的路径
+    def update_repo(self, repo_owner, repo_name, sha, entries):
+        kinds = {'tree': 'dir', 'blob': 'file'}
+        rows = [(entry['path'], kinds[entry['type']]) for entry in entries if entry['type'] in kinds]
+        with self.lock, self.db:
+            self.db.execute('INSERT OR IGNORE INTO repos (owner, name) VALUES (?, ?)', (repo_owner, repo_name))
+            repo_id = self.db.execute('SELECT id FROM repos WHERE owner = ? AND name = ?',
+                                      (repo_owner, repo_name)).fetchone()[0]
+            self.delete_files(repo_id)
+            self.db.executemany('INSERT INTO files (repo_id, path, kind) VALUES (?, ?, ?)',
+                                [(repo_id, path, kind) for path, kind in rows])
+            if self.fts:
+                self.db.execute('INSERT INTO file_paths (rowid, path) SELECT id, path FROM files WHERE repo_id = ?',
+                                (repo_id,))
+            self.db.execute('UPDATE repos SET sha = ? WHERE id = ?', (sha, repo_id))
+
+    # 删除不在列表中的仓库（已删除或不再有权访问）
+    def prune(self, repo_keys):
+        with self.lock, self.db:
+            for repo_id, owner, name in self.db.execute('SELECT id, owner, name FROM repos').fetchall():
+                if (owner, name) not in repo_keys:
+                    self.delete_files(repo_id)
+                    self.db.execute('DELETE FROM repos WHERE id = ?', (repo_id,))
+
+    # 删除仓库的所有路径，外部内容表需要用原来的内容通知全文索引删除
+    def delete_files(self, repo_id):
+        if self.fts:
+            self.db.execute("INSERT INTO file_paths (file_paths, rowid, path) "
+                            "SELECT 'delete', id, path FROM files WHERE repo_id = ?", (repo_id,))
+        self.db.execute('DELETE FROM files WHERE repo_id = ?', (repo_id,))
+
+    # 查找路径中包含text（不区分大小写）的文件和文件夹，返回[(拥有者, 仓库名, 路径, 类型)]
+    def search(self, text, limit=PATH_SEARCH_LIMIT):
+        select = 'SELECT repos.owner, repos.name, files.path, files.kind FROM files JOIN repos ON repos.id = files.repo_id '
+        with self.lock:
+            if self.fts and len(text) >= PATH_SEARCH_MIN_LENGTH:
+                query = '"' + text.replace('"', '""') + '"'  # 作为短语查询，trigram分词下即子串匹配
+                return self.db.execute(select + 'WHERE files.id IN (SELECT rowid FROM file_paths WHERE file_paths MATCH ?) '
+                                                'LIMIT ?', (query, limit)).fetchall()
+            return self.db.execute(select + 'WHERE instr(lower(files.path), ?) LIMIT ?', (text.lower(), limit)).fetchall()
+
+    # 已索引的仓库数和路径数
+    def stats(self):
+        with self.lock:
+            return (self.db.execute('SELECT COUNT(*) FROM repos').fetchone()[0],
+                    self.db.execute('SELECT COUNT(*) FROM files').fetchone()[0])
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+# 建立路径索引线程
+class IndexPathsSignal(QObject):
+    progress_signal = pyqtSignal(int, int)  # (已处理的仓库数, 仓库总数)
+    finish_signal = pyqtSignal(int, list)  # (重新索引的仓库数, 失败的仓库及原因)
+
+
+# 并发获取各仓库默认分支的最新提交，与索引中的SHA比较，只为有变化的仓库获取目录树
+class IndexPaths(QRunnable):
+    def __init__(self, path_index, repos):
+        super().__init__()
+        self.path_index = path_index
+        self.repos = repos  # [(拥有者, 仓库名, 默认分支)]
+        self.signals = IndexPathsSignal()
+
+    def run(self):
+        indexed_shas = self.path_index.repo_shas()
+        updated = 0
+        failures = []
+        with ThreadPoolExecutor(max_workers=REPO_PAGE_WORKERS) as executor:
+            futures = {executor.submit(self.fetch_repo, repo_key, indexed_shas.get(repo_key[:2])): repo_key
+                       for repo_key in self.repos}
+            for done_count, future in enumerate(as_completed(futures), 1):
+                repo_owner, repo_name, branch = futures[future]
+                try:
+                    result = future.result()
+                    if result is not None:  # 有新提交，写入索引
+                        self.path_index.update_repo(repo_owner, repo_name, *result)
+                        updated += 1
+                except (GiteaApiError, requests.exceptions.RequestException) as e:  # 单个仓库失败不影响其它仓库
+                    failures.append(f'{repo_owner}/{repo_name}：{e}')
+                self.signals.progress_signal.emit(done_count, len(futures))
+        self.path_index.prune({repo_key[:2] for repo_key in self.repos})
+        self.signals.finish_signal.emit(updated, failures)
+
+    # 获取仓库的最新提交，没有变化时返回None，否则返回(SHA, 目录树条目)
+    def fetch_repo(self, repo_key, indexed_sha):
+        repo_owner, repo_name, branch = repo_key
+        sha = get_branch_sha(repo_owner, repo_name, branch)
+        if sha == indexed_sha:
+            return None
+        return sha, get_git_tree(repo_owner, repo_name, sha, cached=False)
+
+
+# 目录树节点
+# 每个仓库、文件夹、文件对应一个节点，只保存必要的数据（使用__slots__，每个文件节点只占几十字节），
+# 由GiteaTreeModel按需交给视图显示，不再为每一项创建QTreeWidgetItem
+class TreeNode:
+    __slots__ = ('name', 'parent', 'row', 'checked')
+    kind = ''
+
+    def __init__(self, name, parent=None, checked=False):
+        self.name = name
+        self.parent = parent  # 仓库节点的父节点为None
+        self.row = 0  # 在父节点中的行号
+        self.checked = checked
+
+
+# 文件节点
+class FileNode(TreeNode):
+    __slots__ = ('size',)
+    kind = 'file'
+
+    def __init__(self, name, size, parent=None, checked=False):
+        super().__init__(name, parent, checked)
+        self.size = size
+
+
+# 文件夹节点
+class DirNode(TreeNode):
+    __slots__ = ('children', 'fetched', 'loaded_time')
+    kind = 'dir'
+
+    def __init__(self, name, parent=None, checked=False):
+        super().__init__(name, parent, checked)
+        self.children = None  # 子节点列表，为None表示还没有加载
+        self.fetched = 0  # 已经交给视图显示的子节点数量
+        self.loaded_time = None  # 子节点的加载时间
+
+
+# 仓库节点
+class RepoNode(DirNode):
+    __slots__ = ('owner', 'branch')
+    kind = 'repo'
+
+    def __init__(self, name, owner, branch):
+        super().__init__(name)
+        self.owner = owner
+        self.branch = branch
+
+
+# 目录树模型
+# 子节点全部保存在节点中，但每次只通过canFetchMore/fetchMore向视图交出一批（FETCH_BATCH_SIZE），
+# 只有滚动到的行才会被视图处理
+class GiteaTreeModel(QAbstractItemModel):
+    check_changed = pyqtSignal(list)  # 勾选状态发生变化的节点
+    headers = ('名称', '文件类型', '文件大小', '仓库创建者', '默认分支')
+    type_names = {'repo': '仓库', 'dir': '文件夹', 'file': '文件'}
+    # 视图会频繁调用flags()，预先组合好
+    column_flags = Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable
+    name_flags = column_flags | Qt.ItemFlag.ItemIsUserCheckable
+
+    def __init__(self):
+        super().__init__()
+        self.root = DirNode('')  # 不显示的根节点，子节点为所有仓库
+        self.root.children = []
+        self.header_font = QFont()
+        self.header_font.setPointSize(10)
+
+    # 获取索引对应的节点
+    def node(self, index):
+        return index.internalPointer() if index.isValid() else self.root
+
+    # 获取节点对应的索引
+    def index_of(self, node, column=0):
+        if node is self.root:
+            return QModelIndex()
+        return self.createIndex(node.row, column, node)
+
+    def index(self, row, column, parent=QModelIndex()):
+        parent_node = self.node(parent)
+        if parent_node.kind == 'file' or not 0 <= row < parent_node.fetched or not 0 <= column < len(self.headers):
+            return QModelIndex()
+        return self.createIndex(row, column, parent_node.children[row])
+
+    def parent(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        parent_node = index.internalPointer().parent
+        if parent_node is None:
+            return QModelIndex()
+        return self.createIndex(parent_node.row, 0, parent_node)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        node = self.node(parent)
+        return 0 if node.kind == 'file' else node.fetched
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(self.headers)
+
+    # 仓库和文件夹在加载前也显示展开标志
+    def hasChildren(self, parent=QModelIndex()):
+        if parent.column() > 0:
+            return False
+        return self.node(parent).kind != 'file'
+
+    def canFetchMore(self, parent):
+        node = self.node(parent)
+        return node.kind != 'file' and node.children is not None and node.fetched < len(node.children)
+
+    # 向视图交出下一批子节点
+    def fetchMore(self, parent):
+        node = self.node(parent)
+        count = min(FETCH_BATCH_SIZE, len(node.children) - node.fetched)
+        if count <= 0:
+            return
+        self.beginInsertRows(parent, node.fetched, node.fetched + count - 1)
+        node.fetched += count
+        self.endInsertRows()
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        node = index.internalPointer()
+        column = index.column()
+        if role == Qt.ItemDataRole.DisplayRole:
+            if column == 0:
+                return node.name
+            elif column == 1:
+                return self.type_names[node.kind]
+            elif column == 2 and node.kind == 'file':
+                return str(node.size)
+            elif column == 3 and node.kind == 'repo':
+                return node.owner
+            elif column == 4 and node.kind == 'repo':
+                return node.branch
+        elif role == Qt.ItemDataRole.CheckStateRole and column == 0:
+            return Qt.CheckState.Checked if node.checked else Qt.CheckState.Unchecked
+        return None
+
+    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+        if role != Qt.ItemDataRole.CheckStateRole or index.column() != 0:
+            return False
+        self.set_checked(index.internalPointer(), value in (Qt.CheckState.Checked, Qt.CheckState.Checked.value))
+        return True
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.ItemFlag.NoItemFlags
+        return self.name_flags if index.column() == 0 else self.column_flags
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal:
+            if role == Qt.ItemDataRole.DisplayRole:
+                return self.headers[section]
+            elif role == Qt.ItemDataRole.FontRole:
+                return self.header_font
+        return None
+
+    # 勾选节点时勾选所有子孙节点，取消勾选节点时同时取消勾选所有父节点
+    def set_checked(self, node, checked):
+        changed = []
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            if current.checked != checked:
+                current.checked = checked
+                changed.append(current)
+            if current.kind != 'file' and current.children:
+                stack.extend(current.children)
+                if current.fetched:
+                    self.dataChanged.emit(self.index_of(current.children[0]),
+                                          self.index_of(current.children[current.fetched - 1]),
+                                          [Qt.ItemDataRole.CheckStateRole])
+        self.dataChanged.emit(self.index_of(node), self.index_of(node), [Qt.ItemDataRole.CheckStateRole])
+
+        if not checked:
+            parent_node = node.parent
+            while parent_node is not None:
+                if parent_node.checked:
+                    parent_node.checked = False
+                    changed.append(parent_node)
+                    self.dataChanged.emit(self.index_of(parent_node), self.index_of(parent_node),
+                                          [Qt.ItemDataRole.CheckStateRole])
+                parent_node = parent_node.parent
+
+        if changed:
+            self.check_changed.emit(changed)
+
+    # 在末尾显示已有的仓库节点
+    def insert_repos(self, repo_nodes):
+        if repo_nodes:
+            # 仓库全部直接显示，便于搜索时隐藏或显示
+            first = len(self.root.children)
+            for row, repo_node in enumerate(repo_nodes, first):
+                repo_node.row = row
+            self.beginInsertRows(QModelIndex(), first, first + len(repo_nodes) - 1)
+            self.root.children.extend(repo_nodes)
+            self.root.fetched = len(self.root.children)
+            self.endInsertRows()
+
+    # 用已有的仓库节点替换当前显示的仓库，节点已加载的子节点和勾选状态保持不变
+    def restore_repos(self, repo_nodes):
+        self.beginResetModel()
+        self.root.children = list(repo_nodes)
+        for row, repo_node in enumerate(self.root.children):
+            repo_node.row = row
+        self.root.fetched = len(self.root.children)
+        self.endResetModel()
+
+    # 清空所有仓库
+    def clear_repos(self):
+        self.beginResetModel()
+        self.root.children = []
+        self.root.fetched = 0
+        self.endResetModel()
+
+    # 判断节点是否仍在目录树中（所在的文件夹可能已被刷新删除）
+    def is_attached(self, node):
+        while node.parent is not None:
+            siblings = node.parent.children
+            if siblings is None or node.row >= len(siblings) or siblings[node.row] is not node:
+                return False
+            node = node.parent
+        return node.row < len(self.root.children) and self.root.children[node.row] is node
+
+    # 合并文件夹的子节点
+    # 保留仍然存在的节点及其勾选状态，只添加新节点、删除已不存在的节点
+    # 这是一个生成器，每处理MERGE_CHUNK_SIZE条yield一次，调用方在两块之间让出事件循环；结束时返回被删除的节点
+    def merge_children(self, node, data):
+        if node.children is None:
+            node.children = []
+        existing_nodes = {child.name: child for child in node.children}
+        keep = set()  # 合并后保留的节点（id）
+        new_nodes = []
+        for start in range(0, len(data), MERGE_CHUNK_SIZE):
+            if not self.is_attached(node):
+                return []
+            for contents in data[start:start + MERGE_CHUNK_SIZE]:
+                if contents['type'] not in ('file', 'dir'):
+                    continue
+                child = existing_nodes.get(contents['name'])
+                if child is not None and child.kind == contents['type']:
+                    keep.add(id(child))
+                    if child.kind == 'file' and child.size != contents['size']:
+                        child.size = contents['size']
+                        if child.row < node.fetched:
+                            self.dataChanged.emit(self.index_of(child, 2), self.index_of(child, 2))
+                    continue
+                # 新的子节点与父节点的勾选状态一致，追加到末尾，由fetchMore分批显示
+                if contents['type'] == 'file':
+                    child = FileNode(contents['name'], contents['size'], node, node.checked)
+                else:
+                    child = DirNode(contents['name'], node, node.checked)
+                child.row = len(node.children)
+                node.children.append(child)
+                keep.add(id(child))
+                new_nodes.append(child)
+
+            parent_index = self.index_of(node)
+            if node.fetched < FETCH_BATCH_SIZE and self.canFetchMore(parent_index):
+                self.fetchMore(parent_index)
+            yield
+
+        if not self.is_attached(node):
+            return []
+        removed_nodes = self.remove_children(node, keep)
+        if node.checked and new_nodes:
+            self.check_changed.emit(new_nodes)
+        return removed_nodes
+
+    # 删除不在keep中的子节点，已显示的行按连续区间删除，返回被删除的节点
+    def remove_children(self, node, keep):
+        removed_nodes = [child for child in node.children if id(child) not in keep]
+        if not removed_nodes:
+            return removed_nodes
+
+        parent_index = self.index_of(node)
+        row = node.fetched - 1
+        while row >= 0:
+            if id(node.children[row]) in keep:
+                row -= 1
+                continue
+            end = row
+            while row >= 0 and id(node.children[row]) not in keep:
+                row -= 1
+            self.beginRemoveRows(parent_index, row + 1, end)
+            del node.children[row + 1:end + 1]
+            node.fetched -= end - row
+            self.endRemoveRows()
+
+        # 未显示的部分直接过滤，然后重新编号
+        node.children = node.children[:node.fetched] + \
+            [child for child in node.children[node.fetched:] if id(child) in keep]
+        for row, child in enumerate(node.children):
+            child.row = row
+        return removed_nodes
 
 
 # 全局函数
-# 添加仓库文件或文件夹响应函数
-def add_child_call(data_tuple):
-    data = data_tuple[0]
-    tree_widget_item = data_tuple[1]
-    # 向仓库中添加文件或文件夹
-    for contents in data:
-        if contents['type'] == 'file':  # 如果是文件类型，不可展开
-            contents_item = QTreeWidgetItem(tree_widget_item)
-            contents_item.setText(0, contents["name"])
-            contents_item.setText(1, '文件')
-            contents_item.setText(2, str(contents["size"]))
-            contents_item.setCheckState(0, Qt.CheckState.Unchecked)  # 文件默认不勾选
-            contents_item.setChildIndicatorPolicy(QTreeWidgetItem.ChildIndicatorPolicy.DontShowIndicator)  # 文件不可展开
-
-        elif contents['type'] == 'dir':  # 如果是文件夹类型，可以展开
-            contents_item = QTreeWidgetItem(tree_widget_item)
-            contents_item.setText(0, contents["name"])
-            contents_item.setText(1, '文件夹')
-            contents_item.setCheckState(0, Qt.CheckState.Unchecked)  # 文件夹默认不勾选
-            contents_item.setChildIndicatorPolicy(QTreeWidgetItem.ChildIndicatorPolicy.ShowIndicator)  # 文件夹可以展开
-
-
-# 获取节点类型
-def get_widget_type(widget: QTreeWidgetItem) -> str:
-    if widget.childIndicatorPolicy() == QTreeWidgetItem.ChildIndicatorPolicy.ShowIndicator:
-        return 'dir'
-    elif widget.childIndicatorPolicy() == QTreeWidgetItem.ChildIndicatorPolicy.DontShowIndicator:
-        return 'file'
+# 根据接口返回的仓库信息创建仓库节点
+def create_repo_nodes(data):
+    return [RepoNode(repo_info['name'], repo_info['owner']['login'], repo_info['default_branch']) for repo_info in data]
 
 
 # 获取文件在仓库中的路径
-def get_file_path_in_repo(tree_widget_item):
-    if tree_widget_item.parent() is not None:
-        file_path = tree_widget_item.text(0)  # 获取文件名
-        item = tree_widget_item
-        while item.parent() is not None and item.parent().parent() is not None:
-            item = item.parent()
-            file_path = item.text(0) + '/' + file_path
+def get_file_path_in_repo(node):
+    if node.parent is not None:
+        file_path = node.name  # 获取文件名
+        item = node
+        while item.parent is not None and item.parent.parent is not None:
+            item = item.parent
+            file_path = item.name + '/' + file_path
         return file_path
 
     else:
         return ''
 
 
+# 获取文件夹内容的接口地址，路径中的空格、#、?、%等需要转义
+def get_contents_url(repo_owner, repo_name, file_path):
+    return f'{service_url}/api/v1/repos/{repo_owner}/{repo_name}/contents/{quote(file_path)}'
+
+
+# 获取仓库节点
+def get_repo_node(node):
+    item = node
+    while item.parent is not None:
+        item = item.parent
+    return item
+
+
 # 获取仓库名
-def get_repo_name(tree_widget_item):
-    item = tree_widget_item
-    while item.parent() is not None:
-        item = item.parent()
-    return item.text(0)
+def get_repo_name(node):
+    return get_repo_node(node).name
 
 
 # 获取仓库拥有者
-def get_repo_owner(tree_widget_item):
-    item = tree_widget_item
-    while item.parent() is not None:
-        item = item.parent()
-    return item.text(3)
+def get_repo_owner(node):
+    return get_repo_node(node).owner
 
 
 # 获取仓库默认分支
-def get_repo_default_branch(tree_widget_item):
-    item = tree_widget_item
-    while item.parent() is not None:
-        item = item.parent()
-    return item.text(4)
-
-
-# 检查父文件夹是否在下载列表中
-def is_in_selected_folder(item, download_list):
-    current_item = item
-    while current_item.parent() is not None:
-        if current_item.parent() in download_list:
-            return True
-        current_item = current_item.parent()
-    return False
+def get_repo_default_branch(node):
+    return get_repo_node(node).branch
 
 
-# 对下载列表去重
-def remove_duplicate_item(download_list):
-    for tree_widget_item in download_list:
-        if is_in_selected_folder(tree_widget_item, download_list):
-            download_list.remove(tree_widget_item)
+# 下载选择
+# 按(拥有者, 仓库名)和路径的每一级组织成前缀树，勾选和取消勾选只需沿路径走一遍，
+# 去重时一次遍历即可得到最上层被选中的节点
+class SelectionTrie:
+    def __init__(self):
+        self.root = {}  # 键 -> 子树；子树中键None保存被选中的节点
+
+    # 节点在前缀树中的路径
+    @staticmethod
+    def keys_of(node):
+        keys = []
+        current_node = node
+        while current_node.parent is not None:
+            keys.append(current_node.name)
+            current_node = current_node.parent
+        keys.append((current_node.owner, current_node.name))
+        keys.reverse()
+        return keys
+
+    # 选中节点
+    def add(self, node):
+        subtree = self.root
+        for key in self.keys_of(node):
+            subtree = subtree.setdefault(key, {})
+        subtree[None] = node
+
+    # 取消选中节点，同时删除变空的分支
+    def discard(self, node):
+        self.remove_path(node, subtree_too=False)
+
+    # 取消选中节点及其所有子孙节点（节点已从目录树中删除时使用）
+    def discard_subtree(self, node):
+        self.remove_path(node, subtree_too=True)
+
+    def remove_path(self, node, subtree_too):
+        path = [self.root]
+        keys = self.keys_of(node)
+        for key in keys:
+            subtree = path[-1].get(key)
+            if subtree is None:
+                return
+            path.append(subtree)
+        if subtree_too:
+            path[-1].clear()
+        else:
+            path[-1].pop(None, None)
+        # 从下往上删除空分支
+        for depth in range(len(keys), 0, -1):
+            if path[depth]:
+                break
+            path[depth - 1].pop(keys[depth - 1])
+
+    # 清空
+    def clear(self):
+        self.root = {}
+
+    # 去重后的下载列表：只保留最上层被选中的节点，已被父文件夹包含的节点不再重复下载
+    def collapse(self):
+        nodes = []
+        stack = [self.root]
+        while stack:
+            subtree = stack.pop()
+            if None in subtree:
+                nodes.append(subtree[None])
+                continue
+            stack.extend(reversed(list(subtree.values())))
+        return nodes
+
+
+# 仓库搜索索引
+# 预先保存每个仓库名的小写形式，并按连续三个字符建立倒排索引；
+# 搜索三个字符以上时先对各三字符组的行号集合求交集，只对剩下的候选仓库做子串匹配
+class RepoSearchIndex:
+    def __init__(self):
+        self.names = []  # 小写的仓库名，下标即仓库所在行
+        self.trigrams = {}  # 三字符组 -> 名称中包含它的行号集合
+
+    # 按行号顺序添加仓库
+    def add(self, repo_nodes):
+        for repo_node in repo_nodes:
+            name = repo_node.name.lower()
+            row = len(self.names)
+            self.names.append(name)
+            for i in range(len(name) - 2):
+                self.trigrams.setdefault(name[i:i + 3], set()).add(row)
+
+    def clear(self):
+        self.names = []
+        self.trigrams = {}
+
+    # 返回名称包含text（不区分大小写）的仓库行号集合
+    def search(self, text):
+        text = text.lower()
+        if len(text) < 3:
+            return {row for row, name in enumerate(self.names) if text in name}
+        candidates = sorted((self.trigrams.get(text[i:i + 3], set()) for i in range(len(text) - 2)), key=len)
+        return {row for row in set.intersection(*candidates) if text in self.names[row]}
 
 
 # Git依赖检查
@@ -351,6 +1576,41 @@ def is_repo_initialized(repo_path):
     return os.path.exists(git_folder) and os.path.isdir(git_folder)
 
 
+# 继续中断的下载前，删除上次git进程被强制结束时留下的锁文件
+def remove_stale_git_locks(git_dir):
+    for name in ('index.lock', 'HEAD.lock', 'config.lock', 'shallow.lock', 'info/sparse-checkout.lock'):
+        if os.path.exists(f'{git_dir}/{name}'):
+            os.remove(f'{git_dir}/{name}')
+
+
+# 把仓库设置为origin的部分克隆：缺失的文件内容在需要时向origin补取
+def set_partial_clone(repo):
+    with repo.config_writer() as config:
+        config.set_value('extensions', 'partialClone', 'origin')
+        config.set_value('remote "origin"', 'promisor', 'true')
+        config.set_value('remote "origin"', 'partialclonefilter', 'blob:none')
+
+
+# 共享对象缓存中对应远程仓库的裸仓库，按服务器区分，使用绝对路径写入工作区的alternates
+def get_object_cache_path(repo_owner, repo_name):
+    host = urlsplit(service_url).netloc.replace(':', '_')
+    return os.path.abspath(f'{OBJECT_CACHE_PATH}/{host}/{repo_owner}/{repo_name}.git').replace('\\', '/')
+
+
+# 同一个裸仓库同时只允许一个任务拉取
+def get_object_cache_lock(cache_path):
+    with object_cache_locks_lock:
+        return object_cache_locks.setdefault(cache_path, threading.Lock())
+
+
+# 读取布尔型git配置，交给git读取以包含config.worktree中的配置
+def get_git_config_bool(repo, key):
+    try:
+        return repo.git.config('--bool', '--get', key) == 'true'
+    except git.exc.GitCommandError:  # 没有这个配置项
+        return False
+
+
 # 主UI
 class MainUI:
     def __init__(self):
@@ -360,144 +1620,531 @@ class MainUI:
         self.main_ui.setWindowIcon(icon)
 
         # 定义成员变量
-        self.tree_widget: QTreeWidget = self.main_ui.treeWidget
-        self.log: QTextEdit = self.main_ui.log_textEdit
+        self.tree_view: QTreeView = self.main_ui.treeView
+        self.model = GiteaTreeModel()
+        self.log: QPlainTextEdit = self.main_ui.log_textEdit
+        self.progress_view: QTableView = self.main_ui.progress_tableView
+        self.progress_label: QLabel = self.main_ui.progress_label
+        self.progress_model = DownloadProgressModel()
         self.push_button: QPushButton = self.main_ui.pushButton
         self.refresh_button: QPushButton = self.main_ui.refresh_button
         self.search_name_edit: QLineEdit = self.main_ui.search_name_edit
+        self.search_path_edit: QLineEdit = self.main_ui.search_path_edit
+        self.index_button: QPushButton = self.main_ui.index_button
         self.save_path = ''
         self.repo_list = []  # 缓存仓库列表
-        self.download_list = []  # 下载列表
+        self.repo_nodes = {}  # (拥有者, 仓库名) -> repo_list中的仓库节点
+        self.search_index = RepoSearchIndex()  # 仓库名搜索索引
+        self.search_mode = get_config_value('search_mode', 'local')  # local：在已获取的仓库中搜索；server：由服务器搜索
+        self.search_token = None  # 正在进行的服务器搜索的取消标记
+        self.showing_search = False  # 目录树中显示的是服务器搜索结果
+        self.search_nodes = []  # 服务器搜索结果中不在repo_list里的仓库节点，结果被替换时从下载列表中移除
+        self.path_index = PathIndex(PATH_INDEX_PATH)  # 跨仓库的文件路径索引
+        self.path_results = {}  # 路径搜索结果，显示文本 -> (拥有者, 仓库名, 路径)
+        self.path_completer = QCompleter()  # 在路径搜索框下方列出结果
+        self.path_timer = QTimer()  # 停止输入SEARCH_DELAY毫秒后才搜索路径
+        self.path_timer.setSingleShot(True)
+        self.path_timer.setInterval(SEARCH_DELAY)
+        self.reveal_target = None  # 正在目录树中定位的(节点, 剩余各级名称)
+        self.generation = 0  # 目录树的代数，刷新仓库列表时加一，旧代数的网络任务结果全部丢弃
+        self.repo_token = None  # 正在获取仓库列表的任务的取消标记
+        self.load_tokens = {}  # 正在加载子节点的节点 -> 取消标记，同一节点只保留最新的任务
+        self.hidden_rows = set()  # 搜索时隐藏的仓库行
+        self.search_timer = QTimer()  # 停止输入SEARCH_DELAY毫秒后才搜索
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DELAY)
+        self.selection = SelectionTrie()  # 勾选的仓库、文件夹和文件
+        self.expand_ttl = get_config_value('expand_ttl', 300)  # 已展开的文件夹在多少秒内不重新请求
+        self.tree_mode = get_config_value('tree_mode', 'contents')  # contents：逐个文件夹请求；recursive：一次获取整个目录树
+        self.tree_indexes = {}  # 整树模式下各仓库的目录树索引，键为(拥有者, 仓库名)
+        self.prefetch_depth = get_config_value('prefetch_depth', PREFETCH_DEPTH)  # 展开文件夹后预取几层子文件夹
+        self.prefetch_queue = deque()  # 等待预取的(拥有者, 仓库名, 路径, 剩余层数)，越靠前越先预取
+        self.prefetching = {}  # 正在预取的URL -> 取消标记
+        self.prefetched = {}  # 预取过的URL -> 预取时间，expand_ttl秒内展开时直接使用缓存
+        self.prefetch_waiters = {}  # 展开时预取尚未完成的URL -> 节点，预取完成后再加载
+        self.hover_node = None  # 鼠标停留的节点
+        self.hover_timer = QTimer()  # 鼠标停留HOVER_DELAY毫秒后才预取
+        self.hover_timer.setSingleShot(True)
+        self.hover_timer.setInterval(HOVER_DELAY)
+        self.merge_queue = []  # 等待分块合并的(节点, 合并生成器)
+        self.merge_timer = QTimer()  # 间隔为0，每次事件循环空闲时处理一块
+        self.merge_timer.setInterval(0)
+        self.longest_stall = 0.0  # 合并时单块占用界面线程的最长时间（秒）
+        self.progress_timer = QTimer()  # 下载时定时刷新进度表
+        self.progress_timer.setInterval(PROGRESS_REFRESH_INTERVAL)
         # 线程池
         self.threadpool = QThreadPool()
-        self.threadpool.setMaxThreadCount(15)  # 限制最多线程数
+        self.threadpool.setMaxThreadCount(MAX_THREAD_COUNT)  # 限制最多线程数
+        # 下载调度器，使用独立线程池，下载时不占用浏览用的线程
+        self.downloader = DownloadScheduler(get_config_value('download_concurrency', DOWNLOAD_CONCURRENCY),
+                                            get_config_value('download_mode', DOWNLOAD_MODE),
+                                            get_config_value('direct_file_download', True),
+                                            get_config_value('archive_download', False),
+                                            get_config_value('shared_object_cache', False))
+        self.downloader.info_signal.connect(self.update_log)
+        self.downloader.finish_signal.connect(self.download_finish)
 
         # 调整控件
-        self.tree_widget.header().resizeSection(0, 400)
-        self.tree_widget.header().resizeSection(1, 100)
-        self.tree_widget.header().resizeSection(2, 100)
-        self.tree_widget.header().resizeSection(3, 200)
-        self.tree_widget.header().resizeSection(4, 100)
+        self.tree_view.setModel(self.model)
+        self.tree_view.setUniformRowHeights(True)  # 行高一致，视图不必逐行计算高度
+        self.tree_view.setMouseTracking(True)  # 鼠标移到节点上时发出entered信号
+        self.tree_view.header().resizeSection(0, 400)
+        self.tree_view.header().resizeSection(1, 100)
+        self.tree_view.header().resizeSection(2, 100)
+        self.tree_view.header().resizeSection(3, 200)
+        self.tree_view.header().resizeSection(4, 100)
+        self.log.setMaximumBlockCount(LOG_MAX_LINES)  # 限制日志行数，下载很久时也不会越来越慢
         self.log.hide()
+        self.progress_view.setModel(self.progress_model)
+        self.progress_view.horizontalHeader().resizeSection(0, 200)
+        self.progress_view.hide()
+        self.progress_label.hide()
+        self.path_completer.setModel(QStringListModel())
+        self.path_completer.setCompletionMode(QCompleter.CompletionMode.UnfilteredPopupCompletion)  # 结果已由索引筛选
+        self.path_completer.setMaxVisibleItems(15)
+        self.path_completer.setWidget(self.search_path_edit)  # 不调用setCompleter，选中结果时不改写搜索框
+        if self.path_index.stats()[0]:
+            self.update_index_stats()
 
         # 主窗口启动
         self.main_ui.show()
 
         # 添加仓库
-        self.add_repo(get_repo_url, self.tree_widget)
+        self.add_repo(get_repo_url, self.model.root)
 
         # 信号连接
-        self.tree_widget.itemChanged.connect(self.item_changed)  # 节点勾选框状态改变
-        self.tree_widget.itemChanged.connect(self.change_download_list)  # 管理下载列表
-        self.tree_widget.itemExpanded.connect(self.item_expand)  # 节点被展开
-        self.search_name_edit.textChanged.connect(self.search_repo)  # 搜索框内容变化时
+        self.model.check_changed.connect(self.change_download_list)  # 管理下载列表
+        self.merge_timer.timeout.connect(self.merge_next_chunk)  # 分块合并目录内容
+        self.progress_timer.timeout.connect(self.update_progress)  # 刷新下载进度
+        self.tree_view.expanded.connect(self.item_expand)  # 节点被展开
+        self.tree_view.entered.connect(self.item_hover)  # 鼠标移到节点上
+        self.hover_timer.timeout.connect(self.prefetch_hover)
+        self.tree_view.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
+        self.tree_view.customContextMenuRequested.connect(self.show_context_menu)  # 右键菜单刷新文件夹
+        self.search_name_edit.textChanged.connect(lambda: self.search_timer.start())  # 搜索框内容变化时重新计时
+        self.search_timer.timeout.connect(self.search_repo)
+        self.search_path_edit.textChanged.connect(lambda: self.path_timer.start())  # 路径搜索框内容变化时重新计时
+        self.path_timer.timeout.connect(self.search_path)
+        self.path_completer.activated[str].connect(self.reveal_path_result)  # 选中路径搜索结果
+        self.index_button.clicked.connect(self.index_paths)  # 建立路径索引
         self.refresh_button.clicked.connect(self.refresh_repo)  # 刷新按钮逻辑
         self.push_button.clicked.connect(self.select_download_path)  # 下载按钮逻辑
 
+        # 窗口显示后询问是否继续上次中断的下载
+        QTimer.singleShot(0, self.resume_download)
+
     # 添加用户仓库
-    def add_repo(self, url, tree_widget_item):
+    def add_repo(self, url, node):
         self.repo_list.clear()  # 重新获取仓库时清除缓存
-        add_repo_thread = GetRepos(url, self.main_ui, tree_widget_item)
-        add_repo_thread.signals.get_ready.connect(self.add_repo_call)
-        add_repo_thread.signals.error_signal.connect(self.message_box)
-        self.threadpool.start(add_repo_thread)
+        self.repo_nodes.clear()
+        if self.repo_token is not None:
+            self.repo_token.cancel()
+        token = self.repo_token = CancelToken(self.generation)
+        add_repo_thread = GetRepos(url, self.main_ui, node, token)
+        add_repo_thread.signals.get_ready.connect(self.if_current(token, self.add_repo_call))
+        add_repo_thread.signals.reset_signal.connect(self.if_current(token, self.reset_repo))
+        add_repo_thread.signals.error_signal.connect(self.if_current(token, self.message_box))
+        add_repo_thread.signals.finish_signal.connect(self.update_window_title)
+        self.start_job(add_repo_thread, token)
+
+    # 启动网络任务：启用asyncio网络引擎时作为协程在引擎中运行，否则交给线程池
+    # priority只用于线程池排队；asyncio网络引擎中后台任务自己使用后台信号量
+    def start_job(self, job, token, priority=0):
+        if async_engine is None:
+            self.threadpool.start(job, priority)
+        else:
+            token.future = async_engine.submit(job.run_async())
+
+    # 包装线程信号的响应函数：任务已被取消或属于旧代数时丢弃结果
+    def if_current(self, token, slot):
+        return lambda *args: None if token.cancelled or token.generation != self.generation else slot(*args)
+
+    # 为加载节点子节点的任务创建取消标记，同一节点上一次尚未完成的加载作废
+    def start_load(self, node):
+        if node in self.load_tokens:
+            self.load_tokens[node].cancel()
+        token = self.load_tokens[node] = CancelToken(self.generation)
+        return token
+
+    # 加载任务结束
+    def finish_load(self, node, token):
+        if self.load_tokens.get(node) is token:
+            del self.load_tokens[node]
+        self.update_window_title()
 
     # 添加用户仓库线程响应函数
     def add_repo_call(self, data_tuple):
         data = data_tuple[0]
-        tree_widget_item = data_tuple[1]
-        for repo_info in data:
-            repo_name = repo_info['name']
-            repo_owner = repo_info['owner']['login']
-            branch = repo_info['default_branch']
-            repo_item = QTreeWidgetItem(tree_widget_item)
-            repo_item.setText(0, repo_name)
-            repo_item.setText(1, '仓库')
-            repo_item.setText(3, repo_owner)
-            repo_item.setText(4, branch)
-            repo_item.setChildIndicatorPolicy(QTreeWidgetItem.ChildIndicatorPolicy.ShowIndicator)  # 所有仓库均可展开
-            repo_item.setCheckState(0, Qt.CheckState.Unchecked)  # 仓库默认不勾选
-            self.repo_list.append(repo_item)  # 将仓库项目缓存
+        repo_nodes = create_repo_nodes(data)
+        self.repo_list.extend(repo_nodes)  # 将仓库节点缓存
+        self.repo_nodes.update(((repo_node.owner, repo_node.name), repo_node) for repo_node in repo_nodes)
+        self.search_index.add(repo_nodes)
+        if self.showing_search:  # 正在显示服务器搜索结果，清空搜索框后再显示
+            return
+        self.model.insert_repos(repo_nodes)
+        if self.search_mode == 'local' and self.search_name_edit.text():  # 搜索时新加入的仓库也要过滤
+            self.search_repo()
+
+    # 缓存的仓库列表已过期，清空后由线程重新添加
+    def reset_repo(self, node):
+        self.repo_list.clear()
+        self.repo_nodes.clear()
+        self.search_index.clear()
+        self.hidden_rows.clear()  # 模型重置后视图不再隐藏任何行
+        self.selection.clear()  # 节点已全部重建，原来的勾选不再有效
+        self.merge_queue.clear()
+        if not self.showing_search:
+            self.model.clear_repos()
 
     # 当节点被展开，加载它的子节点
-    def item_expand(self, tree_widget_item):
-        tree_widget_item.takeChildren()
-        repo_name = get_repo_name(tree_widget_item)
-        repo_owner = get_repo_owner(tree_widget_item)
-        file_path = get_file_path_in_repo(tree_widget_item)
-        get_contents_url = f'{service_url}/api/v1/repos/{repo_owner}/{repo_name}/contents/{file_path}'
-        self.add_contents(get_contents_url, tree_widget_item)
+    # 已加载且未过期的节点直接使用已有的子节点，不再请求
+    def item_expand(self, index):
+        node = self.model.node(index)
+        if node.loaded_time is not None and time.monotonic() - node.loaded_time < self.expand_ttl:
+            return
+        self.load_children(node)
 
-    # 添加仓库文件或文件夹
-    def add_contents(self, url, tree_widget_item):
-        add_contents_thread = GetData(url, self.main_ui, tree_widget_item)
-        add_contents_thread.signals.get_ready.connect(add_child_call)
-        add_contents_thread.signals.error_signal.connect(self.message_box)
-        self.threadpool.start(add_contents_thread)
-
-    # 勾选节点时递归勾选子节点
-    def check_children(self, tree_widget_item, state):
-        for i in range(tree_widget_item.childCount()):
-            child = tree_widget_item.child(i)
-            child.setCheckState(0, state)
-            self.check_children(child, state)
-
-    # 取消勾选节点时递归取消勾选父节点
-    def check_parents(self, tree_widget_item, state):
-        if state == Qt.CheckState.Checked:
-            pass
-        else:
-            if tree_widget_item.parent() is not None:
-                tree_widget_item = tree_widget_item.parent()
-                tree_widget_item.setCheckState(0, Qt.CheckState.Unchecked)
-                self.check_parents(tree_widget_item, state)
+    # 右键菜单
+    def show_context_menu(self, pos):
+        index = self.tree_view.indexAt(pos)
+        if not index.isValid() or self.model.node(index).kind == 'file':
+            return
+        index = index.siblingAtColumn(0)
+        menu = QMenu(self.tree_view)
+        refresh_action = menu.addAction('刷新')
+        if menu.exec(self.tree_view.viewport().mapToGlobal(pos)) == refresh_action:
+            if self.tree_view.isExpanded(index):
+                self.load_children(self.model.node(index))
             else:
-                pass
-
-    # 当节点勾选状态变化时
-    def item_changed(self, tree_widget_item, column):
-        self.tree_widget.itemChanged.disconnect(self.item_changed)  # 避免无限递归，断开连接
-
-        if tree_widget_item.childCount() > 0:  # 如果有子节点
-            self.check_children(tree_widget_item, tree_widget_item.checkState(column))
+                self.tree_view.expand(index)  # 未展开过的节点展开时会自动加载
+
+    # 请求节点的子节点
+    def load_children(self, node):
+        repo_name = get_repo_name(node)
+        repo_owner = get_repo_owner(node)
+        file_path = get_file_path_in_repo(node)
+
+        # 整树模式：展开仓库时获取整个目录树，展开文件夹时直接从索引读取
+        if self.tree_mode == 'recursive':
+            repo_key = (repo_owner, repo_name)
+            if node.parent is None or repo_key not in self.tree_indexes:
+                self.add_tree(repo_owner, repo_name, get_repo_default_branch(node), node)
+            else:
+                self.add_contents_call((self.tree_indexes[repo_key].list_dir(file_path), node))
+            return
 
-        if tree_widget_item.parent() is not None:  # 如果有父节点
-            self.check_parents(tree_widget_item, tree_widget_item.checkState(column))
+        url = get_contents_url(repo_owner, repo_name, file_path)
+        if url in self.prefetching:  # 正在预取，预取完成后直接使用结果
+            self.prefetch_waiters[url] = node
+            return
+        revalidate = not self.is_prefetched(url)
+        self.prefetched.pop(url, None)  # 预取的结果只使用一次，之后按expand_ttl重新请求
+        self.add_contents(url, node, revalidate)
 
-        self.main_ui.treeWidget.itemChanged.connect(self.item_changed)  # 重新连接
+    # 添加仓库文件或文件夹
+    def add_contents(self, url, node, revalidate=True):
+        token = self.start_load(node)
+        add_contents_thread = GetData(url, self.main_ui, node, token, revalidate)
+        add_contents_thread.signals.get_ready.connect(self.if_current(token, self.add_contents_call))
+        add_contents_thread.signals.error_signal.connect(self.if_current(token, self.message_box))
+        add_contents_thread.signals.finish_signal.connect(lambda: self.finish_load(node, token))
+        self.start_job(add_contents_thread, token)
+
+    # 获取仓库的整个目录树
+    def add_tree(self, repo_owner, repo_name, branch, node):
+        token = self.start_load(node)
+        add_tree_thread = GetTree(repo_owner, repo_name, branch, node, token)
+        add_tree_thread.signals.get_ready.connect(self.if_current(token, self.add_tree_call))
+        add_tree_thread.signals.error_signal.connect(self.if_current(token, self.message_box))
+        add_tree_thread.signals.finish_signal.connect(lambda: self.finish_load(node, token))
+        self.threadpool.start(add_tree_thread)
+
+    # 获取目录树线程响应函数，保存索引并添加仓库根目录的内容
+    def add_tree_call(self, data_tuple):
+        tree_index = data_tuple[0]
+        node = data_tuple[1]
+        repo_key = (get_repo_owner(node), get_repo_name(node))
+        self.tree_indexes[repo_key] = tree_index
+        self.add_contents_call((tree_index.list_dir(get_file_path_in_repo(node)), node))
+
+    # 添加仓库文件或文件夹线程响应函数
+    # 目录内容加入合并队列，由定时器分块处理，避免大文件夹长时间占用界面线程
+    def add_contents_call(self, data_tuple):
+        data = data_tuple[0]
+        node = data_tuple[1]
+        # 同一文件夹尚未完成的合并作废，由新的合并接着处理
+        self.merge_queue = [job for job in self.merge_queue if job[0] is not node]
+        self.merge_queue.append((node, self.model.merge_children(node, data)))
+        if not self.merge_timer.isActive():
+            self.merge_timer.start()
+
+    # 处理合并队列中的一块
+    def merge_next_chunk(self):
+        if not self.merge_queue:
+            self.merge_timer.stop()
+            self.update_window_title()  # 合并全部完成后显示最长停顿
+            return
+        start = time.perf_counter()
+        node, merge = self.merge_queue[0]
+        try:
+            next(merge)
+        except StopIteration as result:
+            self.merge_queue.pop(0)
+            for removed_node in result.value:  # 已删除的节点及其子孙节点不能再留在下载列表中
+                self.selection.discard_subtree(removed_node)
+            node.loaded_time = time.monotonic()  # 记录加载时间
+            self.prefetch_children(node)
+            self.continue_reveal()
+        self.longest_stall = max(self.longest_stall, time.perf_counter() - start)
+
+    # 鼠标移到节点上，重新计时
+    def item_hover(self, index):
+        self.hover_node = self.model.node(index)
+        self.hover_timer.start()
+
+    # 鼠标在尚未加载的文件夹上停留时预取它的内容
+    def prefetch_hover(self):
+        node = self.hover_node
+        if node is None or node.kind == 'file' or node in self.load_tokens:
+            return
+        if node.loaded_time is not None and time.monotonic() - node.loaded_time < self.expand_ttl:
+            return
+        self.queue_prefetch([(get_repo_owner(node), get_repo_name(node), get_file_path_in_repo(node), 1)], True)
+
+    # 文件夹加载完成后预取它尚未加载的子文件夹
+    def prefetch_children(self, node):
+        subdirs = [child for child in node.children if child.kind == 'dir' and child.children is None]
+        repo_owner = get_repo_owner(node)
+        repo_name = get_repo_name(node)
+        self.queue_prefetch([(repo_owner, repo_name, get_file_path_in_repo(child), self.prefetch_depth)
+                             for child in subdirs[:PREFETCH_BREADTH]], True)
+
+    # 加入预取队列：鼠标停留和刚展开的文件夹放在队首，更深层的放在队尾；超出上限时丢弃队尾
+    # 只有逐个文件夹请求的模式需要预取，整树模式展开时不会请求
+    def queue_prefetch(self, items, urgent):
+        if self.tree_mode != 'contents' or self.prefetch_depth <= 0:
+            return
+        if urgent:
+            self.prefetch_queue.extendleft(reversed(items))
+        else:
+            self.prefetch_queue.extend(items)
+        while len(self.prefetch_queue) > PREFETCH_QUEUE_LIMIT:
+            self.prefetch_queue.pop()
+        self.next_prefetch()
+
+    # 从队列中取出文件夹预取，同时进行的预取不超过PREFETCH_CONCURRENCY个
+    def next_prefetch(self):
+        while self.prefetch_queue and len(self.prefetching) < PREFETCH_CONCURRENCY:
+            item = self.prefetch_queue.popleft()
+            url = get_contents_url(*item[:3])
+            if url not in self.prefetching and not self.is_prefetched(url):
+                self.start_prefetch(url, item)
+
+    # 启动预取任务，优先级低于用户操作的请求
+    def start_prefetch(self, url, item):
+        token = self.prefetching[url] = CancelToken(self.generation)
+        prefetch_thread = Prefetch(url, token)
+        prefetch_thread.signals.finish_signal.connect(lambda data: self.prefetch_finish(url, item, token, data))
+        self.start_job(prefetch_thread, token, PREFETCH_PRIORITY)
+
+    # 预取完成，还有剩余层数时继续预取子文件夹；展开时正在等待的节点现在加载
+    def prefetch_finish(self, url, item, token, data):
+        if self.prefetching.get(url) is not token:  # 已被刷新仓库列表取消
+            return
+        del self.prefetching[url]
+        if data is not None:
+            self.prefetched[url] = time.monotonic()
+            repo_owner, repo_name, file_path, depth = item
+            if depth > 1:
+                subdirs = [entry['path'] for entry in data if entry['type'] == 'dir']
+                self.queue_prefetch([(repo_owner, repo_name, path, depth - 1)
+                                     for path in subdirs[:PREFETCH_BREADTH]], False)
+        node = self.prefetch_waiters.pop(url, None)
+        if node is not None:
+            self.load_children(node)
+        self.next_prefetch()
+
+    # 是否在expand_ttl秒内预取过
+    def is_prefetched(self, url):
+        prefetch_time = self.prefetched.get(url)
+        return prefetch_time is not None and time.monotonic() - prefetch_time < self.expand_ttl
+
+    # 取消所有预取
+    def cancel_prefetch(self):
+        for token in self.prefetching.values():
+            token.cancel()
+        self.prefetching.clear()
+        self.prefetch_queue.clear()
+        self.prefetched.clear()
+        self.prefetch_waiters.clear()
+        self.hover_node = None
 
     # 管理下载列表，勾选节点则加入，取消勾选则移除
-    def change_download_list(self, tree_widget_item, column):
-        check_state = tree_widget_item.checkState(column)
-        if check_state == Qt.CheckState.Checked:
-            self.download_list.append(tree_widget_item)
-        else:
-            try:
-                self.download_list.remove(tree_widget_item)
-            except ValueError:
-                pass
+    def change_download_list(self, nodes):
+        for node in nodes:
+            if node.checked:
+                self.selection.add(node)
+            else:
+                self.selection.discard(node)
 
     # 刷新仓库列表
     def refresh_repo(self):
-        self.tree_widget.clear()  # 清空仓库列表
-        self.add_repo(get_repo_url, self.tree_widget)
+        self.repo_list.clear()
+        self.repo_nodes.clear()
+        self.search_index.clear()
+        self.hidden_rows.clear()
+        self.selection.clear()  # 节点已全部重建，原来的勾选不再有效
+        self.merge_queue.clear()
+        self.reveal_target = None
+        # 取消所有尚未完成的网络任务，迟到的结果按代数丢弃
+        self.generation += 1
+        for token in self.load_tokens.values():
+            token.cancel()
+        self.load_tokens.clear()
+        self.cancel_prefetch()
+        self.cancel_search()
+        self.model.clear_repos()  # 清空仓库列表
+        self.add_repo(get_repo_url, self.model.root)
+        if self.search_mode == 'server' and self.search_name_edit.text():  # 刷新后重新搜索
+            self.search_timer.start()
 
     # 搜索指定仓库
-    def search_repo(self, text):
-        search_text = text
+    # 只在内存中的索引里查找，清空搜索框时直接显示所有仓库，不重新请求；只修改显示状态发生变化的行
+    def search_repo(self):
+        if self.search_mode == 'server':
+            self.search_server()
+            return
+        search_text = self.search_name_edit.text()
+        hidden = set()
+        if search_text:
+            hidden = set(range(self.model.rowCount())) - self.search_index.search(search_text)
+        for row in hidden - self.hidden_rows:
+            self.tree_view.setRowHidden(row, QModelIndex(), True)
+        for row in self.hidden_rows - hidden:
+            self.tree_view.setRowHidden(row, QModelIndex(), False)
+        self.hidden_rows = hidden
+
+    # 在服务器上搜索仓库，结果逐页显示；清空搜索框时恢复显示已获取的仓库列表
+    def search_server(self):
+        search_text = self.search_name_edit.text()
+        showing_search = self.showing_search
+        self.cancel_search()
         if not search_text:
-            self.refresh_repo()
+            if showing_search:
+                self.model.restore_repos(self.repo_list)
             return
+        self.showing_search = True
+        self.model.clear_repos()
+        token = self.search_token = CancelToken(self.generation)
+        search_thread = SearchRepos(search_repo_url, search_text, token)
+        search_thread.signals.get_ready.connect(self.if_current(token, self.add_search_result))
+        search_thread.signals.error_signal.connect(self.if_current(token, self.message_box))
+        self.threadpool.start(search_thread)
+
+    # 取消正在进行的服务器搜索，已发出的结果不再显示
+    # 只属于搜索结果的仓库节点随之离开目录树，其中勾选的内容不能留在下载列表中
+    def cancel_search(self):
+        if self.search_token is not None:
+            self.search_token.cancel()
+            self.search_token = None
+        self.showing_search = False
+        for repo_node in self.search_nodes:
+            self.selection.discard_subtree(repo_node)
+        self.search_nodes = []
+
+    # 服务器搜索线程响应函数
+    # 已获取过的仓库直接显示repo_list中的节点，勾选状态和已加载的内容与完整列表共用
+    def add_search_result(self, data_tuple):
+        repo_nodes = []
+        for repo_node in create_repo_nodes(data_tuple[0]):
+            known_node = self.repo_nodes.get((repo_node.owner, repo_node.name))
+            if known_node is None:
+                self.search_nodes.append(repo_node)
+                repo_nodes.append(repo_node)
+            else:
+                repo_nodes.append(known_node)
+        self.model.insert_repos(repo_nodes)
 
-        # 隐藏所有仓库
-        for item_index in range(self.tree_widget.topLevelItemCount()):
-            top_level_item = self.tree_widget.topLevelItem(item_index)
-            top_level_item.setHidden(True)
-
-        # 遍历仓库列表，显示与搜索文本匹配的仓库
-        for repo_item in self.repo_list:
-            if search_text.lower() in repo_item.text(0).lower():
-                repo_item.setHidden(False)
+    # 获取各仓库的目录树，建立或更新文件路径索引
+    def index_paths(self):
+        if not self.repo_list:
+            return
+        self.index_button.setEnabled(False)
+        repos = [(repo_node.owner, repo_node.name, repo_node.branch) for repo_node in self.repo_list]
+        index_thread = IndexPaths(self.path_index, repos)
+        index_thread.signals.progress_signal.connect(self.index_progress)
+        index_thread.signals.finish_signal.connect(self.index_finish)
+        self.threadpool.start(index_thread)
+
+    # 建立索引线程进度
+    def index_progress(self, done_count, total_count):
+        self.search_path_edit.setPlaceholderText(f' 正在建立索引 {done_count}/{total_count}')
+
+    # 建立索引完成
+    def index_finish(self, updated_count, failures):
+        self.index_button.setEnabled(True)
+        self.update_index_stats()
+        if failures:
+            more = f'\n……等 {len(failures)} 个仓库' if len(failures) > 20 else ''
+            QMessageBox.warning(self.main_ui, "警告", '以下仓库没有建立索引：\n' + '\n'.join(failures[:20]) + more,
+                                QMessageBox.StandardButton.Ok)
+
+    # 在路径搜索框中显示索引规模
+    def update_index_stats(self):
+        repo_count, path_count = self.path_index.stats()
+        self.search_path_edit.setPlaceholderText(f' 在 {repo_count} 个仓库的 {path_count} 个路径中搜索文件')
+
+    # 在路径索引中搜索，结果显示在搜索框下方
+    def search_path(self):
+        search_text = self.search_path_edit.text().strip()
+        results = self.path_index.search(search_text) if len(search_text) >= PATH_SEARCH_MIN_LENGTH else []
+        self.path_results = {f'{repo_owner}/{repo_name}/{file_path}': (repo_owner, repo_name, file_path)
+                             for repo_owner, repo_name, file_path, kind in results}
+        self.path_completer.model().setStringList(list(self.path_results))
+        if results:
+            self.path_completer.complete()
+        else:
+            self.path_completer.popup().hide()
+
+    # 在目录树中定位选中的路径搜索结果
+    def reveal_path_result(self, text):
+        repo_owner, repo_name, file_path = self.path_results[text]
+        repo_node = next((repo_node for repo_node in self.repo_list
+                          if repo_node.owner == repo_owner and repo_node.name == repo_name), None)
+        if repo_node is None:
+            QMessageBox.warning(self.main_ui, "警告", f'仓库列表中没有 {repo_owner}/{repo_name}',
+                                QMessageBox.StandardButton.Ok)
+            return
+        if not self.model.is_attached(repo_node) or repo_node.row in self.hidden_rows:  # 仓库被搜索过滤，先显示所有仓库
+            self.search_name_edit.clear()
+            self.search_timer.stop()
+            self.search_repo()
+        self.reveal_target = (repo_node, file_path.split('/'))
+        self.continue_reveal()
+
+    # 逐级展开路径上的仓库和文件夹，遇到尚未加载的就等加载完成（merge_next_chunk）后再继续
+    def continue_reveal(self):
+        if self.reveal_target is None:
+            return
+        node, names = self.reveal_target
+        index = self.model.index_of(node)
+        while names:
+            self.tree_view.expand(index)  # 未加载的节点展开时开始加载
+            if node.loaded_time is None:
+                return
+            child = next((child for child in node.children if child.name == names[0]), None)
+            if child is None:
+                self.reveal_target = None
+                QMessageBox.warning(self.main_ui, "警告", f'{names[0]} 已不存在，请更新索引', QMessageBox.StandardButton.Ok)
+                return
+            while child.row >= node.fetched:  # 还没有交给视图的子节点
+                self.model.fetchMore(index)
+            node, names = child, names[1:]
+            index = self.model.index_of(node)
+            self.reveal_target = (node, names)
+        self.reveal_target = None
+        self.tree_view.setCurrentIndex(index)
+        self.tree_view.scrollTo(index)
 
     # 选择下载到本地的路径
     def select_download_path(self):
@@ -513,20 +2160,56 @@ class MainUI:
     # 下载选中的文件
     def download_selected(self):
         # 对下载列表去重
-        remove_duplicate_item(self.download_list)
+        download_list = self.selection.collapse()
 
-        if not self.download_list:  # 如果没有选择
+        if not download_list:  # 如果没有选择
             QMessageBox.warning(self.main_ui, "警告", "请选择要下载的文件", QMessageBox.StandardButton.Ok)
+            return
+
+        self.start_download(group_download_list(download_list))
 
-        # 启动下载线程
+    # 启动下载线程
+    def start_download(self, repo_groups, pinned_shas=None):
         self.log.show()
+        self.progress_view.show()
+        self.progress_label.show()
         self.push_button.setEnabled(False)  # 开始下载后禁用按钮
-        self.tree_widget.setEnabled(False)  # 开始下载后禁止与文件浏览器交互
-        self.progress = Progress()
-        self.progress.signals.info_signal.connect(self.update_log)
-        download_thread = Download(self.progress, self.download_list, self.save_path)
-        download_thread.signals.finish_signal.connect(self.download_finish)
-        self.threadpool.start(download_thread)
+        self.tree_view.setEnabled(False)  # 开始下载后禁止与文件浏览器交互
+        self.downloader.start(repo_groups, self.save_path, pinned_shas)
+        self.progress_model.set_jobs(self.downloader.jobs, self.downloader.concurrency)
+        self.update_progress()
+        self.progress_timer.start()
+
+    # 上次的下载没有完成时询问是否继续，不继续则删除未下载完的临时文件
+    def resume_download(self):
+        journal = self.downloader.journal
+        save_path, repo_groups, shas = journal.unfinished()
+        if not repo_groups:
+            return
+        reply = QMessageBox.question(self.main_ui, "继续下载",
+                                     f'上次有 {len(repo_groups)} 个仓库没有下载完成，是否继续下载？\n保存位置：{save_path}')
+        if reply == QMessageBox.StandardButton.Yes:
+            self.save_path = save_path
+            self.start_download(repo_groups, shas)
+            return
+        local_names = local_repo_names(journal.repo_keys(), save_path, self.downloader.sync_state)
+        for repo_key, file_paths in repo_groups.items():
+            for file_path, kind in file_paths:
+                part_path = f'{save_path}/{local_names[repo_key]}/{file_path}.part'
+                if kind == 'file' and os.path.exists(part_path):
+                    os.remove(part_path)
+        journal.clear()
+
+    # 在窗口标题显示缓存命中率和合并目录内容时界面线程的最长停顿
+    def update_window_title(self):
+        title = 'Gitea GUI'
+        cache = gitea_client.cache
+        if cache is not None:
+            total = cache.hits + cache.misses
+            title += f'    缓存命中率 {cache.hit_rate():.0%}（{cache.hits}/{total}）'
+        if self.longest_stall:
+            title += f'    最长停顿 {self.longest_stall * 1000:.0f} ms'
+        self.main_ui.setWindowTitle(title)
 
     # 提示框
     def message_box(self, message):
@@ -534,16 +2217,29 @@ class MainUI:
 
     # 更新日志
     def update_log(self, info):
-        self.log.append(f'{info}\n')
+        self.log.appendPlainText(info)
+
+    # 刷新下载进度表和汇总
+    def update_progress(self):
+        self.progress_model.refresh()
+        self.progress_label.setText(self.progress_model.summary())
 
     # 下载完成
-    def download_finish(self):
-        QMessageBox.information(self.main_ui, "成功", '所有文件下载完成！', QMessageBox.StandardButton.Ok)
+    def download_finish(self, failures):
+        self.progress_timer.stop()
+        self.update_progress()
+        if failures:
+            QMessageBox.warning(self.main_ui, "警告", '以下仓库下载失败：\n' + '\n'.join(failures), QMessageBox.StandardButton.Ok)
+        else:
+            QMessageBox.information(self.main_ui, "成功", '所有文件下载完成！', QMessageBox.StandardButton.Ok)
         self.log.hide()
         self.log.clear()
+        self.progress_view.hide()
+        self.progress_label.hide()
+        self.progress_model.set_jobs([], 1)
         # 恢复交互
         self.push_button.setEnabled(True)
-        self.tree_widget.setEnabled(True)
+        self.tree_view.setEnabled(True)
 
 
 # 文件下载线程
@@ -551,66 +2247,819 @@ class MainUI:
 class Signals(QObject):
     finish_signal = pyqtSignal()
     info_signal = pyqtSignal(str)
+    error_signal = pyqtSignal(str)
 
 
-# 下载进度获取
+# 下载进度获取，每个仓库一个，日志前加上仓库名以区分并发的任务
+# git每输出一行进度就会调用一次update，这里只记录各阶段的状态，按PROGRESS_INTERVAL限制发送给界面的次数
 class Progress(remote.RemoteProgress):
-    def __init__(self):
+    op_names = {
+        remote.RemoteProgress.COUNTING: '统计对象',
+        remote.RemoteProgress.COMPRESSING: '压缩对象',
+        remote.RemoteProgress.WRITING: '写入对象',
+        remote.RemoteProgress.RECEIVING: '接收对象',
+        remote.RemoteProgress.RESOLVING: '处理差异',
+        remote.RemoteProgress.FINDING_SOURCES: '查找来源',
+        remote.RemoteProgress.CHECKING_OUT: '检出文件',
+    }
+
+    def __init__(self, repo_name, job):
         super().__init__()
         self.signals = Signals()
+        self.repo_name = repo_name
+        self.job = job  # 进度表中这个仓库的进度，各阶段的结构化状态都记录在其中
+        self.last_report = 0.0
+
+    def update(self, op_code, cur_count, max_count=None, message=''):
+        stage = op_code & self.OP_MASK
+        name = self.op_names.get(stage, '')
+        self.job.set_stage(name, cur_count, max_count)
+        if stage == self.RECEIVING:
+            received = parse_size(message)
+            if received is not None:
+                self.job.set_received(received)
+        if max_count:
+            text = f'{name} {cur_count / max_count:.0%} ({cur_count:.0f}/{max_count:.0f})'
+        else:
+            text = f'{name} {cur_count or 0:.0f}'
+        if message:
+            text += f', {message}'
+        self.status(text, force=bool(op_code & self.END))  # 每个阶段结束时一定显示
+
+    # 进度信息，距上次显示不足PROGRESS_INTERVAL时丢弃
+    def status(self, text, force=False):
+        now = time.monotonic()
+        if force or now - self.last_report >= PROGRESS_INTERVAL:
+            self.last_report = now
+            self.message(text)
+
+    # 一定显示的信息
+    def message(self, text):
+        self.signals.info_signal.emit(f'[{self.repo_name}] {text}')
+
+
+SIZE_UNITS = {'bytes': 1, 'KiB': 1024, 'MiB': 1024 ** 2, 'GiB': 1024 ** 3}  # git进度信息中的大小单位
+
+
+# 解析git进度信息中的已接收大小，如"2.03 MiB | 26.68 MiB/s"
+def parse_size(message):
+    match = re.match(r'\s*([\d.]+) (bytes|KiB|MiB|GiB)', message)
+    if match is None:
+        return None
+    return float(match.group(1)) * SIZE_UNITS[match.group(2)]
+
+
+# 把字节数转换成便于阅读的大小
+def format_size(size):
+    for unit in ('B', 'KiB', 'MiB'):
+        if size < 1024:
+            return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.2f} GiB'
+
+
+# 把秒数转换成"时:分:秒"
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}:{minutes:02d}:{seconds:02d}' if hours else f'{minutes}:{seconds:02d}'
+
+
+# 单个仓库下载任务的进度
+# 下载线程写入当前阶段、数量和已接收字节数，界面按PROGRESS_REFRESH_INTERVAL读取，计算速度、剩余时间和是否停滞
+class JobProgress:
+    state_names = {'pending': '等待', 'running': '下载中', 'done': '完成', 'skipped': '跳过', 'failed': '失败'}
+
+    def __init__(self, repo_key):
+        self.repo_key = repo_key
+        self.state = 'pending'
+        self.stage = ''  # 当前阶段名称
+        self.cur = 0  # 当前阶段已完成的数量（对象数或文件数）
+        self.total = None  # 当前阶段的总数，未知时为None
+        self.received = 0  # 已接收的字节数
+        self.expected = 0  # 直接下载文件时已知的总字节数（各文件的Content-Length之和）
+        self.rate = 0.0  # 下载速度（字节/秒）
+        self.started = None
+        self.finished = None
+        self.stage_started = None
+        self.last_change = None  # 最近一次有进度的时间
+        self.rate_sample = (0.0, 0)  # 上次计算速度时的(时间, 已接收字节数)
+        self.lock = threading.Lock()  # 直接下载文件时多个线程同时累加字节数
+
+    def start(self):
+        now = time.monotonic()
+        self.state = 'running'
+        self.stage = '准备'
+        self.started = self.stage_started = self.last_change = now
+        self.rate_sample = (now, 0)
+
+    def set_stage(self, stage, cur, total=None):
+        now = time.monotonic()
+        if stage != self.stage:
+            self.stage = stage
+            self.stage_started = now
+            self.cur = None
+        if cur != self.cur:
+            self.last_change = now
+        self.cur = cur or 0
+        self.total = total or None
+
+    # 设置已接收的字节数，每隔RATE_WINDOW秒按增量更新一次速度
+    def set_received(self, received):
+        now = time.monotonic()
+        with self.lock:
+            if received != self.received:
+                self.last_change = now
+            self.received = received
+            sample_time, sample_received = self.rate_sample
+            if now - sample_time >= RATE_WINDOW:
+                self.rate = (received - sample_received) / (now - sample_time)
+                self.rate_sample = (now, received)
+
+    def add_received(self, size):
+        self.set_received(self.received + size)
+
+    def add_expected(self, size):
+        with self.lock:
+            self.expected += size
+
+    def finish(self, state):
+        self.state = state
+        self.finished = time.monotonic()
+        self.rate = 0.0
+
+    # 当前速度，超过RATE_WINDOW没有收到数据时速度逐渐降为0
+    def current_rate(self, now):
+        sample_time, sample_received = self.rate_sample
+        if self.state != 'running':
+            return 0.0
+        if now - sample_time > 2 * RATE_WINDOW:
+            return (self.received - sample_received) / (now - sample_time)
+        return self.rate
+
+    # 估算剩余时间（秒），无法估算时返回None
+    # 知道总字节数时按当前速度计算，否则按当前阶段已用时间和完成比例计算
+    def eta(self, now):
+        if self.state != 'running':
+            return None
+        rate = self.current_rate(now)
+        if self.expected and rate > 0:
+            return max(self.expected - self.received, 0) / rate
+        if not self.total or not self.cur:
+            return None
+        return (now - self.stage_started) * (self.total - self.cur) / self.cur
+
+    def stalled(self, now):
+        return self.state == 'running' and now - self.last_change > STALL_TIMEOUT
+
+
+# 下载进度表：每行一个仓库，显示状态、阶段、进度、已接收大小、速度和剩余时间
+class DownloadProgressModel(QAbstractTableModel):
+    headers = ('仓库', '状态', '阶段', '进度', '已接收', '速度', '剩余时间')
 
-    def update(self, *args):
-        self.signals.info_signal.emit(self._cur_line)
+    def __init__(self):
+        super().__init__()
+        self.jobs = []
+        self.concurrency = 1
+        self.now = time.monotonic()
+
+    def set_jobs(self, jobs, concurrency):
+        self.beginResetModel()
+        self.jobs = jobs
+        self.concurrency = concurrency
+        self.now = time.monotonic()
+        self.endResetModel()
+
+    # 下载线程只修改JobProgress的属性，这里定时通知视图重新读取
+    def refresh(self):
+        self.now = time.monotonic()
+        if self.jobs:
+            self.dataChanged.emit(self.index(0, 1), self.index(len(self.jobs) - 1, len(self.headers) - 1))
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.jobs)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or role != Qt.ItemDataRole.DisplayRole:
+            return None
+        job = self.jobs[index.row()]
+        column = index.column()
+        if column == 0:
+            return f'{job.repo_key[0]}/{job.repo_key[1]}'
+        elif column == 1:
+            return '停滞' if job.stalled(self.now) else job.state_names[job.state]
+        elif column == 2:
+            return job.stage
+        elif column == 3 and job.state == 'running':
+            if job.total:
+                return f'{job.cur / job.total:.0%} ({job.cur:.0f}/{job.total:.0f})'
+            return f'{job.cur:.0f}' if job.cur else ''
+        elif column == 4 and job.received:
+            return format_size(job.received)
+        elif column == 5 and job.state == 'running':
+            return f'{format_size(job.current_rate(self.now))}/s'
+        elif column == 6:
+            eta = job.eta(self.now)
+            if eta is not None:
+                return format_duration(eta)
+            if job.finished is not None:
+                return f'用时 {format_duration(job.finished - job.started)}'
+        return None
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return self.headers[section]
+        return None
+
+    # 整批下载的汇总
+    # 剩余时间 = 正在下载的仓库中最长的剩余时间 + 排队仓库数 / 并发数 × 已完成仓库的平均用时
+    def summary(self):
+        now = self.now
+        finished = [job for job in self.jobs if job.finished is not None]
+        running = [job for job in self.jobs if job.state == 'running']
+        queued = len(self.jobs) - len(finished) - len(running)
+        received = sum(job.received for job in self.jobs)
+        rate = sum(job.current_rate(now) for job in running)
+        stalled = sum(job.stalled(now) for job in running)
+        failed = sum(job.state == 'failed' for job in finished)
+        lines = [f'完成 {len(finished)}/{len(self.jobs)}' + (f'，失败 {failed}' if failed else ''),
+                 f'{format_size(received)}，{format_size(rate)}/s']
+        etas = [job.eta(now) for job in running]
+        if running and None not in etas and (queued == 0 or finished):
+            eta = max(etas)
+            if queued:
+                average = sum(job.finished - job.started for job in finished) / len(finished)
+                eta += math.ceil(queued / self.concurrency) * average
+            lines.append(f'剩余 {format_duration(eta)}')
+        if stalled:
+            lines.append(f'{stalled} 个仓库停滞')
+        return '\n'.join(lines)
+
+
+# 按（创建者，仓库，分支）对下载列表分组，每个仓库只拉取一次
+def group_download_list(download_list):
+    repo_groups = {}
+    for node in download_list:
+        key = (get_repo_owner(node), get_repo_name(node), get_repo_default_branch(node))
+        repo_groups.setdefault(key, []).append((get_file_path_in_repo(node), node.kind))
+    return repo_groups
+
+
+# 没有tarfile.data_filter时（Python 3.11.4以前）自行检查压缩包条目：
+# 只解压普通文件和文件夹，跳过链接等特殊条目；路径不能是绝对路径，也不能包含".."跳出目标文件夹
+def is_safe_archive_member(member, file_path):
+    if not (member.isfile() or member.isdir()):
+        return False
+    parts = file_path.replace('\\', '/').split('/')
+    return not file_path.startswith(('/', '\\')) and ':' not in parts[0] and '..' not in parts
+
+
+# 各仓库在保存位置中的文件夹名
+# 同名仓库（如fork和上游）要放在不同的文件夹中，加上拥有者区分；Gitea仓库名中不能有"@"
+# 已经属于某个仓库的文件夹继续给它使用，只给后来的同名仓库加上拥有者，避免已下载的仓库换文件夹后整个重新下载
+def local_repo_names(repo_keys, save_path, sync_state):
+    name_counts = Counter(repo_name for repo_owner, repo_name, repo_default_branch in repo_keys)
+    local_names = {}
+    for repo_key in repo_keys:
+        repo_owner, repo_name = repo_key[0], repo_key[1]
+        qualified_name = f'{repo_name}@{repo_owner}'
+        folder_owner = local_repo_owner(f'{save_path}/{repo_name}', sync_state)
+        if folder_owner == (repo_owner, repo_name):
+            local_names[repo_key] = repo_name
+        elif os.path.exists(f'{save_path}/{qualified_name}'):  # 以前和同名仓库一起下载过
+            local_names[repo_key] = qualified_name
+        elif folder_owner is None and name_counts[repo_name] == 1:
+            local_names[repo_key] = repo_name
+        else:
+            local_names[repo_key] = qualified_name
+    return local_names
 
 
+# 本地文件夹属于哪个仓库，返回(拥有者, 仓库名)，不知道时返回None
+# 优先使用同步记录，旧版本的记录中没有仓库时从git远程仓库地址中读取
+def local_repo_owner(local_repo_path, sync_state):
+    repo = sync_state.repo(local_repo_path)
+    if repo is not None or not os.path.isdir(f'{local_repo_path}/.git'):
+        return repo
+    try:
+        remote_repo_url = git.Repo(local_repo_path).remote().url
+    except (git.exc.GitError, ValueError):  # 不是有效的仓库或没有origin
+        return None
+    parts = urlsplit(remote_repo_url).path.rstrip('/').removesuffix('.git').split('/')
+    return tuple(parts[-2:]) if len(parts) >= 2 else None
+
+
+# 把选中的(路径, 类型)转换成cone模式的目录集合，返回None表示检出整个仓库
+# cone模式只能按目录匹配：选中的文件用所在目录代替，同目录下的其它文件也会被检出；根目录下的文件总会检出
+def cone_dirs(selected):
+    dirs = set()
+    for path, kind in selected:
+        if kind == 'repo':
+            return None
+        if kind == 'file':
+            path = path.rpartition('/')[0]
+        if path:
+            dirs.add(path)
+
+    # 去掉已被上级目录包含的目录
+    result = set()
+    for path in sorted(dirs, key=len):
+        parts = path.split('/')
+        if not any('/'.join(parts[:k]) in result for k in range(1, len(parts))):
+            result.add(path)
+    return sorted(result)
+
+
+# 把文件内容分块写入本地，先写入临时文件，下载完整后再替换
+# resume为True时用Range请求从已有.part文件的末尾继续下载
+# job不为None时把接收到的字节数累加到任务进度
+def download_file(url, file_path, resume=False, job=None):
+    part_path = f'{file_path}.part'
+    start = os.path.getsize(part_path) if resume and os.path.exists(part_path) else 0
+    headers = {'Range': f'bytes={start}-', 'Accept-Encoding': 'identity'} if start else {}
+    with gitea_client.get(url, stream=True, headers=headers) as response:
+        if response.status_code == 416:  # .part文件已经完整，只是还没有替换
+            os.replace(part_path, file_path)
+            return
+        if response.status_code not in (200, 206):
+            raise GiteaApiError(http_error_message(response, url))
+        if job is not None:
+            job.add_expected(int(response.headers.get('Content-Length', 0)))
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(part_path, 'ab' if response.status_code == 206 else 'wb') as f:
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+                if job is not None:
+                    job.add_received(len(chunk))
+    os.replace(part_path, file_path)
+
+
+# 记录每个本地仓库文件夹上次同步到的提交SHA和已下载的(路径, 类型)，下次下载时没有变化的仓库直接跳过
+class SyncState:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()  # 多个下载任务同时更新
+        self.repos = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.repos = json.load(f)
+
+    def get(self, local_repo_path):
+        with self.lock:
+            state = self.repos.get(os.path.abspath(local_repo_path))
+        if state is None:
+            return None
+        return state['sha'], [tuple(item) for item in state['paths']]
+
+    # 文件夹中下载的仓库(拥有者, 仓库名)，旧版本的记录中没有时返回None
+    def repo(self, local_repo_path):
+        with self.lock:
+            state = self.repos.get(os.path.abspath(local_repo_path))
+        if state is None or 'repo' not in state:
+            return None
+        return tuple(state['repo'])
+
+    def update(self, local_repo_path, repo_key, sha, paths):
+        with self.lock:
+            self.repos[os.path.abspath(local_repo_path)] = {'repo': list(repo_key[:2]), 'sha': sha,
+                                                            'paths': [list(item) for item in dict.fromkeys(paths)]}
+            write_json_file(self.path, self.repos)
+
+
+# 下载任务日志：记录每个仓库的状态（pending：等待，fetching：正在拉取，checked_out：已检出）和提交SHA，
+# 程序被关闭或网络中断后，下次启动时可以继续下载没有完成的仓库
+class DownloadJournal:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.save_path = ''
+        self.jobs = {}  # 键为"创建者/仓库/分支"
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.save_path = data['save_path']
+            self.jobs = data['jobs']
+
+    # 开始新的一批下载
+    def start(self, save_path, repo_groups):
+        with self.lock:
+            self.save_path = save_path
+            self.jobs = {'/'.join(repo_key): {'file_paths': [list(item) for item in file_paths], 'state': 'pending',
+                                              'sha': None}
+                         for repo_key, file_paths in repo_groups.items()}
+            self.save()
+
+    def set_state(self, repo_key, state, sha):
+        with self.lock:
+            job = self.jobs.get('/'.join(repo_key))
+            if job is not None:
+                job['state'] = state
+                job['sha'] = sha
+                self.save()
+
+    # 一批下载结束后只保留没有完成的仓库，全部完成时删除日志
+    def finish(self):
+        with self.lock:
+            self.jobs = {key: job for key, job in self.jobs.items() if job['state'] != 'checked_out'}
+            self.save()
+
+    # 没有完成的仓库，返回(保存位置, 仓库分组, 各仓库正在下载的提交SHA)
+    def unfinished(self):
+        with self.lock:
+            repo_groups = {}
+            shas = {}
+            for key, job in self.jobs.items():
+                if job['state'] == 'checked_out':
+                    continue
+                repo_key = tuple(key.split('/', 2))  # 分支名中可能有"/"
+                repo_groups[repo_key] = [tuple(item) for item in job['file_paths']]
+                shas[repo_key] = job['sha']
+            return self.save_path, repo_groups, shas
+
+    # 本批的所有仓库（包括已经完成的），继续下载时据此确定各仓库的文件夹
+    def repo_keys(self):
+        with self.lock:
+            return [tuple(key.split('/', 2)) for key in self.jobs]
+
+    def clear(self):
+        with self.lock:
+            self.jobs = {}
+            self.save()
+
+    def save(self):
+        if self.jobs:
+            write_json_file(self.path, {'save_path': self.save_path, 'jobs': self.jobs})
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+
+
+# 先写临时文件再替换，避免中途退出留下损坏的文件
+def write_json_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(f'{path}.tmp', path)
+
+
+# 筛选出上次同步没有下载过，或者本地已被删除的路径
+def unsynced_paths(local_repo_path, synced_paths, file_paths):
+    synced = set(synced_paths)
+    synced_dirs = {path for path, kind in synced_paths if kind != 'file'}  # 整个仓库的路径为''
+    result = []
+    for path, kind in file_paths:
+        parts = path.split('/') if path else []
+        covered = (path, kind) in synced or any('/'.join(parts[:k]) in synced_dirs for k in range(len(parts)))
+        if not covered or not os.path.exists(f'{local_repo_path}/{path}'):
+            result.append((path, kind))
+    return result
+
+
+# 下载调度器：每个仓库一个下载任务，限制同时下载的仓库数，单个仓库失败不影响其它仓库
+class DownloadScheduler(QObject):
+    info_signal = pyqtSignal(str)
+    finish_signal = pyqtSignal(list)  # 下载失败的仓库及原因
+
+    def __init__(self, concurrency, download_mode, direct_file_download, archive_download, shared_object_cache):
+        super().__init__()
+        self.download_mode = download_mode
+        self.direct_file_download = direct_file_download  # 只选了文件时不经过git，直接下载
+        self.archive_download = archive_download  # 下载压缩包解压出快照，不保留git历史
+        self.shared_object_cache = shared_object_cache  # 同一个仓库下载到多个位置时共用对象
+        self.sync_state = SyncState(SYNC_STATE_PATH)
+        self.journal = DownloadJournal(DOWNLOAD_JOURNAL_PATH)
+        self.resuming = False  # 正在继续上次中断的下载
+        self.concurrency = max(1, concurrency)
+        self.threadpool = QThreadPool()
+        self.threadpool.setMaxThreadCount(self.concurrency)
+        self.pending = 0  # 尚未结束的任务数
+        self.failures = []
+        self.jobs = []  # 本批各仓库的下载进度，顺序与repo_groups相同
+
+    # 为每个仓库创建下载任务，超出并发数的任务在线程池中排队
+    # 继续中断的下载时传入上次记录的提交SHA：直接下载和压缩包继续下载同一个提交，git拉取分支最新提交并记录实际检出的提交
+    def start(self, repo_groups, save_path, pinned_shas=None):
+        self.pending = len(repo_groups)
+        self.failures = []
+        self.resuming = pinned_shas is not None
+        if not self.resuming:
+            self.journal.start(save_path, repo_groups)
+        self.jobs = [JobProgress(repo_key) for repo_key in repo_groups]
+        # 继续下载时只剩部分仓库，文件夹名仍按整批确定
+        local_names = local_repo_names(self.journal.repo_keys(), save_path, self.sync_state)
+        for job, (repo_key, file_paths) in zip(self.jobs, repo_groups.items()):
+            progress = Progress(repo_key[1], job)
+            progress.signals.info_signal.connect(self.info_signal)
+            pinned_sha = pinned_shas.get(repo_key) if self.resuming else None
+            local_repo_path = f'{save_path}/{local_names[repo_key]}'
+            download_thread = Download(self, progress, repo_key, file_paths, local_repo_path, pinned_sha)
+            download_thread.signals.error_signal.connect(self.job_failed)
+            download_thread.signals.finish_signal.connect(self.job_finished)
+            self.threadpool.start(download_thread)
+
+    def job_failed(self, message):
+        self.failures.append(message)
+        self.info_signal.emit(message)
+
+    # 所有任务结束后汇总结果
+    def job_finished(self):
+        self.pending -= 1
+        if self.pending == 0:
+            self.journal.finish()
+            self.finish_signal.emit(self.failures)
+
+
+# 下载一个仓库的线程
 class Download(QRunnable):
-    def __init__(self, progress, download_list, save_path):
+    def __init__(self, scheduler, progress, repo_key, file_paths, local_repo_path, pinned_sha=None):
         super().__init__()
         self.signals = Signals()
         self.progress = progress
-        self.download_list = download_list
-        self.save_path = save_path
+        self.repo_key = repo_key
+        self.file_paths = file_paths
+        self.local_repo_path = local_repo_path  # 保存位置中此仓库的文件夹
+        # 下载设置
+        self.download_mode = scheduler.download_mode
+        self.direct_file_download = scheduler.direct_file_download
+        self.archive_download = scheduler.archive_download
+        self.shared_object_cache = scheduler.shared_object_cache
+        self.sync_state = scheduler.sync_state
+        self.journal = scheduler.journal
+        self.resuming = scheduler.resuming
+        self.head_sha = pinned_sha  # 要下载的提交，为None时使用远程分支最新提交
 
     def run(self):
-        # 创建本地仓库文件夹
-        for widget_item in self.download_list:
-            repo_name = get_repo_name(widget_item)
-            repo_owner = get_repo_owner(widget_item)
-            repo_default_branch = get_repo_default_branch(widget_item)
-            local_repo_path = f'{self.save_path}/{repo_name}'
-            remote_repo_url = f'{service_url}/{repo_owner}/{repo_name}.git'
-            config_file_path = f'{local_repo_path}/.git/info/sparse-checkout'
-            os.makedirs(local_repo_path, exist_ok=True)  # 确保仓库文件夹存在
-            file_path_in_repo = get_file_path_in_repo(widget_item)
-            if not file_path_in_repo:  # 如果这个文件夹是仓库
-                file_path_in_repo = '*'
-            else:
-                file_path_in_repo = f'/{file_path_in_repo}'  # 从根目录开始匹配，以防错误
-
-            # git操作
-            repo = None
-            # 如果没初始化就初始化
-            if not is_repo_initialized(local_repo_path):
-                repo = git.Repo.init(local_repo_path)
-                repo.create_remote(name='origin', url=remote_repo_url)  # 设置远程仓库
-                repo.config_writer().set_value("core", "sparseCheckout", "true").release()  # 启用sparse-checkout功能
+        repo_owner, repo_name, repo_default_branch = self.repo_key
+        local_repo_path = self.local_repo_path
+        job = self.progress.job
+        job.start()
+        try:
+            # 远程分支没有新提交时，只下载上次没有下载过的路径，全部下载过就跳过这个仓库
+            if self.head_sha is None:
+                self.head_sha = get_branch_sha(repo_owner, repo_name, repo_default_branch)
+            head_sha = self.head_sha
+            synced = self.sync_state.get(local_repo_path)
+            unchanged = synced is not None and synced[0] == head_sha
+            file_paths = self.file_paths
+            if unchanged:
+                file_paths = unsynced_paths(local_repo_path, synced[1], file_paths)
+                if not file_paths:
+                    self.progress.message('远程仓库没有新提交，跳过')
+                    self.journal.set_state(self.repo_key, 'checked_out', head_sha)
+                    job.finish('skipped')
+                    return
+            self.journal.set_state(self.repo_key, 'fetching', head_sha)
+
+            # 本地已是git仓库的继续用git管理；否则只选了文件时直接下载文件，选了文件夹时可以用压缩包
+            only_files = all(kind == 'file' for path, kind in file_paths)
+            git_checkout = is_repo_initialized(local_repo_path)
+            if git_checkout:
+                head_sha = self.download_repo(repo_owner, repo_name, repo_default_branch, file_paths)
+            elif self.direct_file_download and only_files:
+                self.download_files(repo_owner, repo_name, repo_default_branch, file_paths)
+            elif self.archive_download:
+                self.download_archive(repo_owner, repo_name, repo_default_branch, file_paths)
             else:
-                repo = git.Repo(local_repo_path)
-
-            # 向配置文件写入要下载的文件
-            with open(config_file_path, 'a', encoding='utf-8') as f:
-                f.write(f'{file_path_in_repo}\n')
-
-            # 拉取到工作区
+                git_checkout = True
+                head_sha = self.download_repo(repo_owner, repo_name, repo_default_branch, file_paths)
+
+            # git会把已检出的路径一起更新到新提交；直接下载和压缩包只更新了这次的路径，旧路径在分支变化后不再算已同步
+            if synced is not None and (unchanged or git_checkout):
+                file_paths = synced[1] + file_paths
+            self.sync_state.update(local_repo_path, self.repo_key, head_sha, file_paths)
+            self.journal.set_state(self.repo_key, 'checked_out', head_sha)
+            job.finish('done')
+        except Exception as e:  # 捕获所有错误，只让这个仓库失败
+            job.finish('failed')
+            self.signals.error_signal.emit(f'{repo_owner}/{repo_name}：{e}')
+        finally:
+            self.signals.finish_signal.emit()
+
+    # 不经过git，通过media接口并行下载选中的文件
+    def download_files(self, repo_owner, repo_name, repo_default_branch, file_paths):
+        local_repo_path = self.local_repo_path
+        failures = []
+        with ThreadPoolExecutor(max_workers=MAX_THREAD_COUNT) as executor:
+            futures = {}
+            for file_path, kind in file_paths:
+                # 按提交SHA下载，内容不会变化，中断后可以从.part文件的末尾继续
+                url = f'{service_url}/api/v1/repos/{repo_owner}/{repo_name}/media/{self.head_sha}/{quote(file_path)}'
+                future = executor.submit(download_file, url, f'{local_repo_path}/{file_path}', self.resuming,
+                                         self.progress.job)
+                futures[future] = file_path
+            self.progress.job.set_stage('下载文件', 0, len(futures))
+            for done_count, future in enumerate(as_completed(futures), 1):
+                try:
+                    future.result()
+                except Exception as e:  # 单个文件失败时继续下载其它文件
+                    failures.append(f'{futures[future]}：{e}')
+                self.progress.job.set_stage('下载文件', done_count, len(futures))
+                self.progress.status(f'已下载 {done_count}/{len(futures)} 个文件', force=done_count == len(futures))
+        if failures:
+            raise GiteaApiError('\n'.join(failures))
+
+    # 流式下载仓库压缩包，边下载边解压，只解压选中的文件和文件夹
+    def download_archive(self, repo_owner, repo_name, repo_default_branch, file_paths):
+        local_repo_path = self.local_repo_path
+        url = f'{service_url}/api/v1/repos/{repo_owner}/{repo_name}/archive/{self.head_sha}.tar.gz'
+        selected = {path for path, kind in file_paths}  # 选中整个仓库时包含''，匹配所有文件
+        has_filter = hasattr(tarfile, 'data_filter')
+        extract_options = {'filter': 'data'} if has_filter else {}  # 拒绝解压到目标文件夹之外
+        extracted_count = 0
+        with gitea_client.get(url, stream=True) as response:
+            if response.status_code != 200:
+                raise GiteaApiError(http_error_message(response, url))
+            response.raw.decode_content = True
+            with tarfile.open(fileobj=response.raw, mode='r|gz') as archive:
+                for member in archive:
+                    self.progress.job.set_received(response.raw.tell())  # 已接收的压缩数据大小
+                    file_path = member.name.partition('/')[2]  # 去掉压缩包中的"仓库名/"前缀
+                    parts = file_path.split('/')
+                    if not file_path or not any('/'.join(parts[:k]) in selected for k in range(len(parts) + 1)):
+                        continue
+                    if not has_filter and not is_safe_archive_member(member, file_path):
+                        self.progress.message(f'跳过不安全的压缩包条目：{member.name}')
+                        continue
+                    member.name = file_path
+                    archive.extract(member, local_repo_path, **extract_options)
+                    if member.isfile():
+                        extracted_count += 1
+                        self.progress.job.set_stage('解压文件', extracted_count)
+                        self.progress.status(f'已解压 {extracted_count} 个文件')
+        self.progress.message(f'已解压 {extracted_count} 个文件')
+
+    # 下载一个仓库中选中的所有文件
+    # git拉取的是分支的最新提交，可能比self.head_sha新，返回实际检出的提交
+    def download_repo(self, repo_owner, repo_name, repo_default_branch, file_paths):
+        # 创建本地仓库文件夹
+        local_repo_path = self.local_repo_path
+        remote_repo_url = f'{service_url}/{repo_owner}/{repo_name}.git'
+        os.makedirs(local_repo_path, exist_ok=True)  # 确保仓库文件夹存在
+
+        # git操作
+        repo = None
+        # 如果没初始化就初始化
+        fresh = not is_repo_initialized(local_repo_path)
+        if fresh:
+            repo = git.Repo.init(local_repo_path)
+            repo.create_remote(name='origin', url=remote_repo_url)  # 设置远程仓库
+            existing_dirs = []
+        else:
+            if self.resuming:
+                remove_stale_git_locks(f'{local_repo_path}/.git')
+            repo = git.Repo(local_repo_path)
+            if 'origin' not in [item.name for item in repo.remotes]:  # 上次在初始化后立即中断
+                repo.create_remote(name='origin', url=remote_repo_url)
+            existing_dirs = self.existing_sparse_dirs(repo, local_repo_path)
+
+        # 与已检出的目录合并去重
+        sparse_dirs = None
+        if existing_dirs is not None:
+            sparse_dirs = cone_dirs([(path, 'dir') for path in existing_dirs] + file_paths)
+
+        # 新仓库还没有提交，先写入规则，拉取后只检出需要的文件
+        if fresh:
+            self.apply_sparse_dirs(repo, sparse_dirs)
+
+        # 拉取到工作区
+        if self.shared_object_cache:
+            self.fetch_via_object_cache(repo, repo_owner, repo_name, repo_default_branch, sparse_dirs)
+        elif self.download_mode == 'partial':
+            self.fetch_partial(repo, repo_default_branch)
+        else:
             repo.remote().pull(f'{repo_default_branch}:master',
                                progress=self.progress)  # 从远程仓库的默认分支拉取到本地master分支（本地默认分支为master）
             repo.git.reset('--hard', repo.head.commit)
 
-        self.signals.finish_signal.emit()
+        # 已有仓库先按原规则更新到最新提交，再检出新增的目录，避免为旧提交获取文件
+        # 旧版本的非cone规则即使目录没有变化也要转换为cone模式
+        if not fresh and existing_dirs is not None and \
+                (sparse_dirs != existing_dirs or not get_git_config_bool(repo, 'core.sparseCheckoutCone')):
+            self.apply_sparse_dirs(repo, sparse_dirs)
+        return repo.head.commit.hexsha
+
+    # 读取已检出的目录，返回None表示已检出整个仓库
+    def existing_sparse_dirs(self, repo, local_repo_path):
+        if not get_git_config_bool(repo, 'core.sparseCheckout'):
+            return None
+        if get_git_config_bool(repo, 'core.sparseCheckoutCone'):
+            return repo.git(c='core.quotePath=false').sparse_checkout('list').splitlines()
+
+        # 旧版本逐行追加的非cone规则
+        selected = []
+        with open(f'{local_repo_path}/.git/info/sparse-checkout', encoding='utf-8') as f:
+            for line in f:
+                path = line.strip().strip('/')
+                if path == '*':
+                    return None
+                if path:
+                    kind = 'file' if os.path.isfile(f'{local_repo_path}/{path}') else 'dir'
+                    selected.append((path, kind))
+        return cone_dirs(selected)
+
+    # 用git sparse-checkout写入规则并更新工作区
+    def apply_sparse_dirs(self, repo, sparse_dirs):
+        if sparse_dirs is None:
+            repo.git.sparse_checkout('disable')
+        else:
+            repo.git.sparse_checkout('set', '--cone', *sparse_dirs)
+
+    # 浅克隆加部分克隆：只取最新提交和目录树，检出时git按sparse-checkout规则向远程补取需要的文件内容
+    def fetch_partial(self, repo, repo_default_branch):
+        set_partial_clone(repo)
+        repo.remote().fetch(f'+{repo_default_branch}:refs/remotes/origin/{repo_default_branch}',
+                            progress=self.progress, depth=1, filter='blob:none')
+        self.progress.job.set_stage('检出文件', 0)  # 检出时补取文件内容，git不输出进度
+        repo.git.reset('--hard', f'origin/{repo_default_branch}')  # 更新本地master分支和工作区
+
+    # 先拉取到共享的裸仓库，工作区通过objects/info/alternates直接使用其中的对象，自己不再拉取和保存
+    def fetch_via_object_cache(self, repo, repo_owner, repo_name, repo_default_branch, sparse_dirs):
+        cache_path = get_object_cache_path(repo_owner, repo_name)
+        with get_object_cache_lock(cache_path):
+            cache = self.update_object_cache(cache_path, repo.remote().url, repo_default_branch)
+            sha = cache.git.rev_parse(f'refs/heads/{repo_default_branch}')
+            if self.download_mode == 'partial':
+                self.prefetch_blobs(cache, sha, sparse_dirs)
+
+        # 让工作区使用缓存中的对象
+        alternates_path = f'{repo.git_dir}/objects/info/alternates'
+        alternates = []
+        if os.path.exists(alternates_path):
+            with open(alternates_path, 'r', encoding='utf-8') as f:
+                alternates = f.read().splitlines()
+        if f'{cache_path}/objects' not in alternates:
+            with open(alternates_path, 'a', encoding='utf-8') as f:
+                f.write(f'{cache_path}/objects\n')
+
+        # 浅克隆的缓存没有更早的提交，工作区也要记录同样的浅克隆边界
+        if os.path.exists(f'{cache_path}/shallow'):
+            shutil.copyfile(f'{cache_path}/shallow', f'{repo.git_dir}/shallow')
+            set_partial_clone(repo)  # 万一缺少文件内容，仍可以向origin补取
+        repo.git.update_ref(f'refs/remotes/origin/{repo_default_branch}', sha)
+        repo.git.reset('--hard', sha)
+
+    # 创建或更新共享的裸仓库，分支已是远程最新提交时不联网
+    def update_object_cache(self, cache_path, remote_repo_url, repo_default_branch):
+        if os.path.isdir(cache_path):
+            if self.resuming:
+                remove_stale_git_locks(cache_path)
+            cache = git.Repo(cache_path)
+            try:
+                if cache.git.rev_parse(f'refs/heads/{repo_default_branch}') == self.head_sha:
+                    return cache
+            except git.exc.GitCommandError:  # 还没有拉取过这个分支
+                pass
+        else:
+            cache = git.Repo.init(cache_path, mkdir=True, bare=True)
+            cache.create_remote(name='origin', url=remote_repo_url)
+
+        refspec = f'+{repo_default_branch}:refs/heads/{repo_default_branch}'
+        if self.download_mode == 'partial':
+            set_partial_clone(cache)
+            cache.remote().fetch(refspec, progress=self.progress, depth=1, filter='blob:none')
+        else:
+            cache.remote().fetch(refspec, progress=self.progress)
+        return cache
+
+    # 部分克隆的缓存中没有文件内容，一次性补取需要检出的目录中缺少的文件
+    # cone模式还会检出根目录和每个所选目录的各级父目录下直接存放的文件，这些文件也要补取
+    def prefetch_blobs(self, cache, sha, sparse_dirs):
+        # rev-list的--missing=print只列出缺少的对象，不会触发补取
+        missing = {line[1:] for line in cache.git.rev_list('--objects', '--missing=print', sha).splitlines()
+                   if line.startswith('?')}
+        if not missing:
+            return
+        parent_dirs = {''}
+        for sparse_dir in sparse_dirs or ():
+            parts = sparse_dir.split('/')
+            parent_dirs.update('/'.join(parts[:k]) for k in range(1, len(parts)))
+        wanted = []
+        for entry in cache.git.ls_tree('-r', '-z', sha).split('\0'):
+            if not entry:
+                continue
+            info, file_path = entry.split('\t', 1)
+            mode, kind, oid = info.split()
+            parts = file_path.split('/')
+            in_sparse_dirs = sparse_dirs is None or '/'.join(parts[:-1]) in parent_dirs or \
+                any('/'.join(parts[:k]) in sparse_dirs for k in range(1, len(parts)))
+            if kind == 'blob' and oid in missing and in_sparse_dirs:
+                wanted.append(oid)
+        if wanted:
+            self.progress.message(f'补取 {len(wanted)} 个文件')
+            self.progress.job.set_stage('补取文件', 0, len(wanted))
+            # 与git部分克隆自动补取时使用的参数相同，按对象ID批量拉取
+            command = ['git', '-c', 'fetch.negotiationAlgorithm=noop', 'fetch', 'origin', '--no-tags',
+                       '--no-write-fetch-head', '--filter=blob:none', '--stdin']
+            result = subprocess.run(command, cwd=cache.git_dir, input='\n'.join(wanted), text=True, capture_output=True)
+            if result.returncode != 0:
+                raise git.exc.GitCommandError(command, result.returncode, result.stderr)
 
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
+    app.aboutToQuit.connect(close_clients)
 
     # 登录界面
     loginUI = LoginUI()